@@ -7,30 +7,83 @@
 # Updated by Edith Baader and Liam Gaffney
 
 import wx
-from mhv4lib import mhv4lib
+import mhv4lib_orig as mhv4lib # in-tree MHV-4 driver
 import n1419lib
 import nhrlib
 import time
-from serial.tools import list_ports
+import os
 import threading
+import concurrent.futures
 import queues #File with definition of queue and queue elements
-import requests
+import portexecutor
+import discovery
+import hotplug
+import health
+import hvserial
+import hvcache
+import pollscheduler
+import rampengine
+import rampplanner
+import telemetry
 import urllib3
 import numpy as np
 
 
 # Mesytec specific options
 RAMP_VOLTAGE_STEP = 1	# the amount of voltage which is changed at once while ramping
-RAMP_WAIT_TIME = 2	# the time between to voltage steps
+RAMP_WAIT_TIME = 2	# the time between to voltage steps when ramping without the RampEngine
+RAMP_RATE_MHV4 = 1	# the ramp rate in V/s of the RampEngine, the same as RAMP_RATE_CAEN
+MHV4_RAMP_SPEEDS = (5, 25, 100, 500)	# the ramp speeds in V/s of the MHV-4 settings 0 to 3
+MHV4_HARDWARE_RAMP = None	# ramp speed setting (0 to 3) to let the MHV-4 ramp by itself, None to ramp in steps at RAMP_RATE_MHV4
+RAMP_CURRENT_EXCURSION = 1.	# rise of the current in uA during a MHV-4 hardware ramp which stops the ramp at the present voltage
 VOLTAGE_LIMIT = 350	# maximal voltage which can be applied
 USING_NEW_FIRMWARE = True
 START_VOLTAGE=0.1	# the voltage which is set after turning on a channel, this is to be sure, that channels which are turned on have a 				voltage unequal to zero
 
 # CAEN specific options
 RAMP_RATE_CAEN = 1 # the default ramp rate on the CAEN N1419 modules
+RAMP_RATES_CAEN = (1, 50)	# the smallest and largest ramp rates in V/s of the CAEN and NHR units, in whole V/s
 
 # GUI options
-UPDATE_TIME=3		# the voltages and currents are updated in the GUI every 3 s
+UPDATE_TIME=3		# the voltages are updated in the GUI every 3 s
+POLL_PERIODS = {	# period in s of reading each parameter of all channels, see Unit.poll()
+	'current' : 1,
+	'voltage' : UPDATE_TIME,
+	'state' : UPDATE_TIME,	# enabled and preset voltage
+	'polarity' : 60,
+	'limits' : hvcache.TTLS['current_limit'],	# the cached limits are read again as they expire
+}
+POLL_MODES = {		# periods replacing POLL_PERIODS, chosen by Unit.adaptPolls()
+	'active' : { 'current' : 0.5, 'voltage' : 1, 'state' : 1 },	# ramping, after an alarm or a change
+	'normal' : {},
+	'steady' : { 'current' : 5, 'voltage' : 15, 'state' : 15 },	# nothing changed for STEADY_TIME
+}
+ACTIVE_HOLD_TIME = 10	# the unit is polled fast for 10 s after the last change of a channel
+ALARM_HOLD_TIME = 60	# ... and for 60 s after an alarm
+STEADY_TIME = 300	# the polling backs off after 5 min without changes
+CURRENT_CHANGE = 0.1	# change of the current in uA that counts as a change of the channel
+VOLTAGE_CHANGE = 0.5	# change of the voltage in V that counts as a change of the channel
+RAMP_BITS = { 'n1419' : 2|4, 'nhr' : 16 }	# status bits of a ramping channel (up, down)
+ALARM_BITS = { 'n1419' : 8|16|32|128|256|512|2048|4096, 'nhr' : 2|4|32|4096|8192|16384|32768 }	# OVC OVV UNV TRIP OVP OVT KILL ILK, arc, input error, emergency, inhibit, trip and limits
+POLL_REPORT_TIME = 600	# the achieved polling rates are printed every 10 min
+HV_TYPE_NAMES = { 'mhv4' : 'MHV-4', 'nhr' : 'NHR', 'n1419' : 'N1419' }	# names of the unit types in the messages
+DISCOVERY_CACHE = os.path.join( os.path.expanduser('~'), '.hvgui_ports.json' )	# CAEN boards found on each port, see discovery
+BRINGUP_THREADS = 8	# units connected and read at the same time at startup, see bringUp()
+HOTPLUG_TIME = 2	# the USB ports are listed every 2 s to notice units that are unplugged or plugged in again
+HOTPLUG_RETRY_TIME = 30	# the offline units are looked for again every 30 s even if no port appeared
+CLOSE_TIMEOUT = 10	# time in s allowed for closing the port of a unit that went offline, see Unit.goOffline()
+BREAKER_TIMEOUTS = 3	# a unit is no longer read after 3 timeouts in a row ...
+BREAKER_BACKOFF = 2	# ... but probed after 2 s, 4 s, 8 s ...
+BREAKER_MAX_BACKOFF = 60	# ... up to every 60 s until it answers, see Unit.poll()
+ALARM_POLL_TIME = 1	# the board alarm of the CAEN units is polled every 1 s (6 % of a 9600 baud port per board), see Unit.readParameter()
+BOARD_ALARM_BITS = 16|32|64	# board alarms of the CAEN units (power fail, over power, HV clock fail), which concern all channels
+NHR_EVENT_POLLING = True	# poll the event status of the NHR units instead of their state and voltages, see Unit.pollPeriods()
+NHR_REFRESH_TIME = 60	# ... which are then read every 60 s, or when an event was seen
+GROUP_RAMP_TIME = None	# time in s for ramping several channels together, None for as fast as the slowest channel allows
+GROUP_RAMP_MAX_RATE = 5	# the largest rate in V/s of a channel ramped together with others, see rampGroup()
+TELEMETRY_URL = 'https://dbod-iss.cern.ch:8080/write?db=hv'	# InfluxDB of the readings, see telemetry
+TELEMETRY_AUTH = ("admin","issmonitor")
+TELEMETRY_TIMEOUT = 5	# time in s allowed for sending the readings, which never holds up a port
 
 #------------------------Defintion of events----------------------------------------------
 #The events are necessary to prevent the GUI from freezing. For any change in the appearance of the GUI, an event is used.
@@ -104,8 +157,8 @@ class Update(wx.PyCommandEvent):
            return self._value
 
 #-------------------Thread------------------------------------------------
-#Thread which checks every 3 s (UPDATE_TIME) the current values and in between if any button was pressed. 
-#If so, the voltage / polarity or are changed, or the channel will be turned on or off.
+#Thread which waits until any button was pressed. If so, the voltage / polarity are changed, or the channel will be turned on or off.
+#The MHV-4 voltages are ramped by the RampEngine. The values are read by the PollScheduler.
 class CheckAndUpdater(threading.Thread):
 	def __init__(self,unitView):
 		"""
@@ -114,94 +167,77 @@ class CheckAndUpdater(threading.Thread):
 		"""
 		threading.Thread.__init__(self)
 		self._parent = unitView
-		self._updateCounter=0	#will increase after every time.sleep until it's equal to the UPDATE_TIME                          
    
 	def run(self):
 		"""Overrides Thread.run. Don't call this directly its called internally
 		when you call Thread.start().
 		"""
 		while 1:
-			if self._parent.Vqueue.isEmpty()==False: #Check if there is an element in the voltage change queue
-				element=self._parent.Vqueue.root
-				while element!=None:
-					i=element.channel
-					cur=self._parent.channelViews[i].unit.myunit.getVoltage(i) #get the current voltage of the channel
-					time.sleep(0.1) 
-					self._updateCounter=self._updateCounter+0.1
-					wan=self._parent.channelViews[i].wantedVoltage #get the wanted voltage
-					if cur==0:
-						print("Voltage of channel "+str(i)+" of unit "+self._parent.myunit.name+" turned unexpectedly to zero!")
-						self._parent.channelViews[i].changeVol=False #Ramping will be stopped and the element removed from the queue
-						b=element.next
-						self._parent.Vqueue.remove(element)
-						element=b
-					else:
-						if (cur != wan):
-							if abs(cur-wan) <= RAMP_VOLTAGE_STEP: 
-								self._parent.channelViews[i].changeVol=False
-								Cvalue = wan
-								b=element.next
-								self._parent.Vqueue.remove(element)
-								element=b
-							else:
-								element=element.next
-								if (wan - cur > 0) : Cvalue=cur+RAMP_VOLTAGE_STEP# going up	
-								else: Cvalue = cur-RAMP_VOLTAGE_STEP # coming down
-							evt = CountEvent(myEVT_COUNT, -1, Cvalue) #create the event that tells the GUI to update
-							wx.PostEvent(self._parent.channelViews[i], evt) 
-							cur=self._parent.channelViews[i].unit.myunit.setVoltage(i,Cvalue) #set the new voltage
-							time.sleep(0.1) 
-							self._updateCounter=self._updateCounter+0.1
-						else:
-							b=element.next
-							self._parent.Vqueue.remove(element) #if the wanted voltage is equal to the current, remove elment from the queue
-							element=b
+			self._parent.work.clear() # set again by any click from here on
 			
-			if self._parent.Pqueue.isEmpty()==False: #Check if there is an element in the changing polarity and enable/disable queue
-				element=self._parent.Pqueue.root
-				while element!=None:
-					i=element.channel
-					if(element.option==1): #Option 1 is enable/disable a channel
-						newvalue=element.value
-						evt1 = EnableChange(myEnableChange, -1, newvalue)
-						wx.PostEvent(self._parent.channelViews[i], evt1)
-						if 1 == newvalue :
-							self._parent.channelViews[i].unit.myunit.enableChannel(i)
-							time.sleep(0.1) 
-							self._updateCounter=self._updateCounter+0.1
-							if self._parent.channelViews[i].unit.myunit.hvtype == 'mhv4':
-								self._parent.channelViews[i].unit.myunit.setVoltage(i,START_VOLTAGE)
-								time.sleep(0.1) 
-								self._updateCounter=self._updateCounter+0.1
-						if 0 == newvalue : 
-							self._parent.channelViews[i].unit.myunit.disableChannel(i)
-							time.sleep(0.1) 
-							self._updateCounter=self._updateCounter+0.1
-					else: #a change in the polarity was requested
-						newpolarity=element.value
-						evt2 = PolarityChange(myPolarityChange, -1, 1)
-						wx.PostEvent(self._parent.channelViews[i], evt2)
-						self._parent.channelViews[i].unit.myunit.setPolarity(i,newpolarity)
-						time.sleep(0.1) 
-						self._updateCounter=self._updateCounter+0.1
-						#self._parent.channelViews[i].changePol=False
-					b=element.next
-					self._parent.Pqueue.remove(element)
-					element=b
-					
-			time.sleep(RAMP_WAIT_TIME)
-			self._updateCounter=self._updateCounter+RAMP_WAIT_TIME
+			item=self._parent.Pqueue.get() #Take the polarity changes and enable/disable requests one by one
+			while item!=None:
+				(unit,i,operation),newvalue=item
+				if not unit.isReachable():
+					print("{name} is offline, the change of channel {ch} is dropped".format(name=unit.name, ch=i))
+				elif operation=='enable':
+					evt1 = EnableChange(myEnableChange, -1, newvalue)
+					wx.PostEvent(self._parent.channelViews[i], evt1)
+					if 1 == newvalue :
+						unit.perform(unit.enableChannel, i)
+						if unit.hvtype == 'mhv4':
+							unit.setVoltage(i,START_VOLTAGE)
+					if 0 == newvalue : 
+						unit.perform(unit.disableChannel, i)
+				else: #a change in the polarity was requested
+					evt2 = PolarityChange(myPolarityChange, -1, 1)
+					wx.PostEvent(self._parent.channelViews[i], evt2)
+					unit.perform(unit.setPolarity, i, newvalue)
+				item=self._parent.Pqueue.get()
+			
+			changes=[] #Start the ramps to the wanted voltages, a new voltage for a ramping channel changes its target
+			item=self._parent.Vqueue.get()
+			while item!=None:
+				(unit,i,operation),wan=item
+				if unit.isReachable():
+					changes.append( (unit,i,wan) )
+				else:
+					print("{name} is offline, the voltage of channel {ch} is not set".format(name=unit.name, ch=i))
+				item=self._parent.Vqueue.get()
+			if len(changes) > 1: # several channels at once reach their voltages together
+				rampGroup(changes, GROUP_RAMP_TIME)
+			elif changes:
+				unit,i,wan = changes[0]
+				unit.setVoltage(i,wan)
 			
-			if self._updateCounter>=UPDATE_TIME:
-				self._updateCounter=0
-				#print(self._parent.myunit.name+"Check started")
-				for i in range(4):
-					self._parent.myunit.updateValues(i)
-					evt3 = Update(myUpdate, -1, 1)
-					wx.PostEvent(self._parent.channelViews[i], evt3)
-					time.sleep(0.1)
-					self._updateCounter=self._updateCounter+0.1
-				#print(self._parent.myunit.name+"Check ended")
+			self._parent.work.wait() # Sleep until the next click. The readings are updated by the PollScheduler
+
+def rampGroup(changes, budget=None):
+	"""Ramp several channels, also of different units (see the RAMP ALL button), so that they
+	reach their voltages together, see rampplanner. The ramps run in parallel on the ports of
+	the units, no channel faster than GROUP_RAMP_MAX_RATE unless its unit can not ramp slower.
+
+	:param changes: List of (unit, channel, voltage).
+	:param budget: Time in s the ramps should take, default as fast as the slowest channel allows.
+	"""
+	planned = []
+	for unit, channel, voltage in changes:
+		if voltage > VOLTAGE_LIMIT:
+			print("Set voltage too high (limit is " + str(VOLTAGE_LIMIT) + " V).")
+		elif unit.rampEngine is None:
+			unit.setVoltage(channel, voltage)
+		else:
+			planned.append( (unit, channel, voltage) )
+	if not planned:
+		return
+	limits = np.array([ unit.rampLimits() for unit, channel, voltage in planned ], dtype=float)
+	max_rate = np.maximum( np.minimum(limits[:,1], GROUP_RAMP_MAX_RATE), limits[:,0] )
+	group = rampplanner.plan( [ unit.channels[channel].voltage for unit, channel, voltage in planned ],
+			[ voltage for unit, channel, voltage in planned ],
+			max_rate=max_rate, min_rate=limits[:,0], resolution=limits[:,2], budget=budget )
+	print( "Ramping {n} channels in {t:.0f} s".format(n=len(group), t=group.duration) )
+	for i, (unit, channel, voltage) in enumerate(planned):
+		unit.rampVoltage(channel, voltage, group.rate[i], group.delay[i], group.start[i])
 
 #------------------------------------------------------------------------------------------#
 
@@ -213,83 +249,447 @@ class Channel:
 		self.current = 0.
 		self.polarity = 0
 		self.enabled = 0.
+		self.currentlimit = 0.
+		self.voltagelimit = 0.
+		self.status = -1	# status bits of the CAEN and NHR units, -1 if unknown
+		self.ramping = False
+		self.lastactive = time.monotonic()	# when the channel last changed, see Unit.adaptPolls()
+		self.alarmtime = None	# when an alarm bit of the channel was last seen
+		self.stale = False	# the last read got no answer, the readings are older
 
 class Unit:
 	def __init__(self, serial, name, hvtype, board):
 		self.port = ''
 		self.hvunit = None
+		self.executor = None # thread that owns the serial port, all commands to the unit go through it
 		self.hvtype = hvtype # mhv4, n1419 or nhr
 		self.board = board # lbus in N1419, unused in MHV4 and NHR
 		self.name = name
 		self.serial = serial
 		self.rampspeed = 0
+		self.settings = hvcache.SettingsCache() # last confirmed ramp speeds, limits and polarities
+		self.listeners = [] # called with the channel number (4 for all) after the readings have changed
+		self.scheduler = None # PollScheduler reading the unit, see schedulePolls()
+		self.rampEngine = None # RampEngine of the MHV-4 ramps, stepped in setVoltage() without it
+		self.telemetry = None # TelemetrySender of the readings, see send_to_influx()
+		self.pollmode = 'normal' # key of POLL_MODES
+		self.alarm = 0 # last board alarm of the CAEN units, see get_alarm()
+		self.online = False # connected, see goOffline()
+		self.breaker = health.CircuitBreaker(BREAKER_TIMEOUTS, BREAKER_BACKOFF, BREAKER_MAX_BACKOFF) # see poll()
+		self.polling = threading.local() # the poll running on the thread, see poll()
 		self.channels = []
 		for i in [0,1,2,3]:
 			self.channels.append(Channel(self,i))
 			
 	def connect(self):
 		if self.hvtype == 'mhv4':
-			self.hvunit = mhv4lib.MHV4(self.port, baud=9600)
+			driver = mhv4lib.MHV4(self.port, baud=9600)
 		elif self.hvtype == 'n1419':
-			self.hvunit = n1419lib.N1419(self.port, baud=9600, board=self.board)
+			driver = n1419lib.N1419(self.port, baud=9600, board=self.board)
 		elif self.hvtype == 'nhr':
-			self.hvunit = nhrlib.NHR(self.port, baud=9600, board=self.board)
+			driver = nhrlib.NHR(self.port, baud=9600, board=self.board)
 		else:
 			print( "Invalid type {}".format(self.hvtype) )
+			return
+		self.executor = portexecutor.get_executor(self.port) # shared by the boards on the same port
+		self.settings.invalidate()
+		self.hvunit = hvcache.CachedDriver(portexecutor.DriverProxy(driver, self.executor), self.settings) # slow-changing parameters are cached
+		self.breaker = health.CircuitBreaker(BREAKER_TIMEOUTS, BREAKER_BACKOFF, BREAKER_MAX_BACKOFF)
+		self.online = True
 		
 	def disconnect(self):
 		self.hvunit.close()
+		self.executor.release()
+
+	def goOffline(self):
+		"""Stop using the unit, e.g. as its port has gone: its reads, ramps and commands stop
+		and the port is released until reconnect(). The readings keep their last values."""
+		if not self.online:
+			return
+		self.online = False
+		print("{name} is offline".format(name=self.name))
+		if self.scheduler is not None:
+			self.scheduler.remove(self)
+		if self.rampEngine is not None:
+			self.rampEngine.cancel(self)
+		self.settings.invalidate()
+		for ch in self.channels:
+			ch.stale = True
+		self.send_to_influx(self.name, 4, 'online', 0)
+		# closed on the executor, after the command on the wire, which fails on the dead port
+		closed = self.executor.submit_for(self.hvunit.board, portexecutor.EMERGENCY, self.hvunit.driver.close)
+		try:
+			closed.result(timeout=CLOSE_TIMEOUT)
+		except Exception as e:
+			print("Closing the port of {name} failed: {e!r}".format(name=self.name, e=e))
+		self.executor.release()
+		for listener in self.listeners:
+			listener(4)
+
+	def reconnect(self, port):
+		"""Connect the unit again on ``port`` after goOffline(), read all of its values and
+		poll it again."""
+		self.port = port
+		self.connect()
+		self.submit(portexecutor.CONTROL, self.updateValues).result()
+		self.send_to_influx(self.name, 4, 'online', 1)
+		if self.scheduler is not None:
+			self.schedulePolls(self.scheduler)
+		print("{name} is back on port {port}".format(name=self.name, port=port))
+		for listener in self.listeners:
+			listener(4)
+
+	def submit(self, lane, fn, *args):
+		"""Run ``fn(*args)`` on the port executor of the unit without waiting for it.
+		Returns a future with the result, which fails while the unit is offline."""
+		if not self.online:
+			future = concurrent.futures.Future()
+			future.set_exception( IOError("{name} is offline".format(name=self.name)) )
+			return future
+		return self.executor.submit_for(self.hvunit.board, lane, fn, *args)
+
+	def perform(self, fn, *args):
+		"""Run the user action ``fn(*args)``, e.g. enableChannel(), on the CONTROL lane of the
+		port and wait for it. Its reads and writes then run in one go ahead of the monitoring
+		reads. Returns the result, or None after printing the error."""
+		try:
+			return self.submit(portexecutor.CONTROL, fn, *args).result()
+		except Exception as e:
+			print("{fn} of {name} failed: {e!r}".format(fn=fn.__name__, name=self.name, e=e))
+
+	def emergencyOff(self):
+		"""Turn all channels OFF ahead of any other queued command, see the ALL OFF button
+		of the UnitView. Returns the futures."""
+		if self.rampEngine is not None:
+			self.rampEngine.cancel(self)
+		if self.hvtype == 'nhr': # no 'all channels' number in the NHR
+			futures = [ self.submit(portexecutor.EMERGENCY, self.hvunit.driver.set_off, ch.channel) for ch in self.channels ]
+		else:
+			futures = [ self.submit(portexecutor.EMERGENCY, self.hvunit.driver.set_off, 4) ]
+		self.markActive(4) # the state is read back quickly
+		return futures
 		
 	def updateValues(self, channel=4):
 		
 		if self.hvunit is None: # FOR DEBUGGING
 			print("HV unit {name} of type {hvtype} not found?".format( name=self.name, hvtype=self.hvtype ) )
 			return
+		timeouts = hvserial.counts()[1] # run on the port executor, see bringUp()
 			
 		if channel < 4: # update values for only one channel in the unit
 			self.channels[channel].voltage  = self.getVoltage(channel)
 			self.channels[channel].current  = self.getCurrent(channel)
 			self.channels[channel].polarity = self.getPolarity(channel)
 			if self.hvtype == 'mhv4':
-				if self.channels[channel].enabled != 1: 
-					if self.channels[channel].voltage > 0.1:
-						self.channels[channel].enabled = 1
-					if self.getVoltagePreset(channel) != 0:
-						self.setVoltage(channel,0)
-						self.channels[channel].setvoltage = 0
-				elif self.channels[channel].voltage == 0:
-					self.hvunit.set_off(channel)
-					self.channels[channel].enabled = 0
+				self.checkMHV4(channel)
 			else:
 				self.channels[channel].enabled = self.hvunit.get_power(channel)
 				self.channels[channel].setvoltage = self.getVoltagePreset(channel)
-
-			self.send_to_influx(self.name, channel, 'actual', self.channels[channel].voltage)
-			self.send_to_influx(self.name, channel, 'current', self.channels[channel].current)
 			time.sleep(0.1)
 			
+		elif self.hvtype == 'n1419' or self.hvtype == 'nhr':	# update all channels in the unit at once
+			values = self.hvunit.get_monitor_all() # 5 commands for the N1419, 2 for the NHR
+			for ch in self.channels:
+				ch.voltage    = abs(values['voltage'][ch.channel])
+				ch.current    = values['current'][ch.channel]
+				ch.polarity   = values['polarity'][ch.channel]
+				ch.enabled    = values['power'][ch.channel]
+				ch.setvoltage = values['voltage_preset'][ch.channel]
 			
-		else:	# update on all channels in the unit
+		else:	# update on all channels in the MHV-4, with one command per parameter
+			voltages   = self.hvunit.get_voltage_all()
+			currents   = self.hvunit.get_current_all()
+			polarities = self.hvunit.get_polarity_all()
 			for ch in self.channels:
-				ch.voltage    = self.getVoltage(ch.channel)
-				ch.current    = self.getCurrent(ch.channel)
-				ch.polarity   = self.getPolarity(ch.channel)
-				if self.hvtype == 'mhv4':
-					if ch.voltage >= 0.1:
-						ch.enabled = 1
-					elif ch.enabled == 1:
-						self.hvunit.set_off(ch.channel)
-						ch.enabled = 0
-					if ch.enabled == 0 and ch.setvoltage > 0:
-						self.setVoltage(ch.channel,0)
-						ch.setvoltage = self.getVoltagePreset(ch.channel)
-				else:
-					ch.enabled = self.hvunit.get_power(ch.channel)
+				ch.voltage    = abs(voltages[ch.channel])
+				ch.current    = currents[ch.channel]
+				ch.polarity   = polarities[ch.channel]
+				if ch.voltage >= 0.1:
+					ch.enabled = 1
+				elif ch.enabled == 1:
+					self.hvunit.set_off(ch.channel)
+					ch.enabled = 0
+				if ch.enabled == 0 and ch.setvoltage > 0:
+					self.setVoltage(ch.channel,0)
 					ch.setvoltage = self.getVoltagePreset(ch.channel)
 
+		stale = hvserial.counts()[1] > timeouts # the drivers return zeros for the commands without answer
+		for ch in self.channels if channel == 4 else [self.channels[channel]]:
+			ch.stale = stale
+			if not stale: # the zeros are not sent as readings
 				self.send_to_influx(self.name, ch.channel, 'actual', ch.voltage)
 				self.send_to_influx(self.name, ch.channel, 'current', ch.current)
-				time.sleep(0.1)
+
+	def isReachable(self):
+		"""Returns True if commands can be sent to the unit: it is connected and answers."""
+		return self.online and not self.breaker.open
+
+	def poll(self, channel, parameter):
+		"""Read one parameter of the channel, or of all channels at once for channel 4, see
+		readParameter(). Called by the PollScheduler on the port executor at the period of
+		the parameter (see POLL_PERIODS).
+		The values of a command that gets no answer are not stored (see readValues()), the
+		readings of the channel keep their last values and are marked stale. After
+		BREAKER_TIMEOUTS timeouts in a row the unit is no longer read but probed, see openCircuit().
+		"""
+		if self.hvunit is None or not self.online:
+			return
+		if parameter == 'probe':
+			self.probe()
+			return
+		outer = not getattr(self.polling, 'active', False) # not called from another poll
+		self.polling.active = True
+		before = hvserial.counts()
+		try:
+			self.readParameter(channel, parameter)
+		finally:
+			if outer:
+				self.polling.active = False
+			answered, timeouts = [ n - n0 for n, n0 in zip(hvserial.counts(), before) ]
+			if timeouts:
+				for ch in self.channels if channel == 4 else [self.channels[channel]]:
+					ch.stale = True
+				self.adaptPolls()
+				for listener in self.listeners:
+					listener(channel)
+			elif answered:
+				for ch in self.channels if channel == 4 else [self.channels[channel]]:
+					ch.stale = False
+		if outer and self.breaker.record(answered, timeouts):
+			self.openCircuit()
+
+	def readValues(self, channel, getAll, get):
+		"""Returns the values of all channels read with ``getAll()`` for channel 4, or the value
+		read with ``get(channel)`` in a list. Returns None if a command got no answer, as the
+		drivers then return zeros that must not be taken for readings."""
+		timeouts = hvserial.counts()[1]
+		values = getAll() if channel == 4 else [get(channel)]
+		if hvserial.counts()[1] > timeouts:
+			return None
+		return values
+
+	def probe(self):
+		"""Send one cheap query to the unit while its circuit is open. Closes the circuit
+		when it answers, otherwise the next probe is scheduled after a longer wait."""
+		before = hvserial.counts()
+		try:
+			self.hvunit.driver.get_voltage(0)
+		except Exception as e: # e.g. the port failed, probed again
+			print("Probing {name} failed: {e!r}".format(name=self.name, e=e))
+		answered, timeouts = [ n - n0 for n, n0 in zip(hvserial.counts(), before) ]
+		if self.breaker.record(answered, timeouts) is False:
+			self.closeCircuit()
+		elif self.breaker.open and self.scheduler is not None: # not after the circuit was closed
+			self.scheduler.add(self, 4, 'probe', self.breaker.next_period())
+
+	def openCircuit(self):
+		"""Stop reading the unit as it does not answer (see poll()) and probe it instead.
+		Its ramps are stopped, and the GUI and the telemetry show it offline."""
+		print("{name} does not answer, it is probed until it does".format(name=self.name))
+		if self.rampEngine is not None:
+			self.rampEngine.cancel(self)
+		if self.scheduler is not None:
+			self.scheduler.remove(self)
+			self.scheduler.add(self, 4, 'probe', self.breaker.next_period())
+		for ch in self.channels:
+			ch.stale = True
+		self.send_to_influx(self.name, 4, 'online', 0)
+		for listener in self.listeners:
+			listener(4)
+
+	def closeCircuit(self):
+		"""Poll the unit again after it answered a probe, reading everything straight away.
+		The cached settings are written again, the unit may have been power cycled."""
+		print("{name} answers again".format(name=self.name))
+		self.settings.invalidate()
+		self.send_to_influx(self.name, 4, 'online', 1)
+		if self.scheduler is not None:
+			self.scheduler.remove(self, parameter='probe')
+			self.schedulePolls(self.scheduler)
+		for parameter in ('state', 'voltage', 'current'): # may open the circuit again
+			self.poll(4, parameter)
+
+	def readParameter(self, channel, parameter):
+		"""Read one parameter of the channel, or of all channels at once for channel 4,
+		the parameters being 'current', 'voltage', 'state' (enabled and preset voltage),
+		'polarity', 'limits', 'alarm' (CAEN) and 'events' (NHR, see pollPeriods()). For the MHV-4 each
+		channel gets the same checks as in updateValues(channel).
+		"""
+		channels = self.channels if channel == 4 else [self.channels[channel]]
+		now = time.monotonic()
+
+		if parameter == 'current':
+			currents = self.readValues(channel, self.hvunit.get_current_all, self.getCurrent)
+			if currents is None:
+				return
+			for ch, current in zip(channels, currents):
+				if abs(current - ch.current) > CURRENT_CHANGE:
+					ch.lastactive = now
+				ch.current = current
+				self.send_to_influx(self.name, ch.channel, 'current', ch.current)
+
+		elif parameter == 'voltage':
+			voltages = self.readValues(channel, self.hvunit.get_voltage_all, self.hvunit.get_voltage)
+			if voltages is None:
+				return
+			for ch, voltage in zip(channels, voltages):
+				if abs(abs(voltage) - ch.voltage) > VOLTAGE_CHANGE: # e.g. the MHV-4, which has no ramp status
+					ch.lastactive = now
+				ch.voltage = abs(voltage)
+				self.send_to_influx(self.name, ch.channel, 'actual', ch.voltage)
+
+		elif parameter == 'state' and self.hvtype == 'mhv4':
+			presets = [None]*len(channels)
+			if any( ch.enabled != 1 for ch in channels ): # only needed for the channels that are off
+				presets = self.readValues(channel, self.hvunit.get_voltage_preset_all, self.getVoltagePreset)
+			if presets is None:
+				return
+			for ch, preset in zip(channels, presets):
+				self.checkMHV4(ch.channel, preset)
+
+		elif parameter == 'state':
+			status = self.readValues(4, self.hvunit.get_status_all, None)
+			if status is None:
+				return
+			if self.hvtype == 'n1419': # the ON bit of the status
+				power = [ -1 if st < 0 else st & 1 for st in status ]
+			else:
+				power = self.readValues(4, self.hvunit.get_power_all, None)
+			presets = self.readValues(channel, self.hvunit.get_voltage_preset_all, self.getVoltagePreset)
+			if power is None or presets is None:
+				return
+			if channel != 4:
+				status, power = [status[channel]], [power[channel]]
+			for ch, st, enabled, preset in zip(channels, status, power, presets):
+				ch.enabled    = enabled
+				ch.setvoltage = preset
+				ch.status     = st
+				ch.ramping    = st >= 0 and bool(st & RAMP_BITS[self.hvtype])
+				if ch.ramping:
+					ch.lastactive = now
+				if st >= 0 and st & ALARM_BITS[self.hvtype]:
+					ch.alarmtime = now
+
+		elif parameter == 'polarity': # cached, see hvcache.TTLS
+			polarities = self.readValues(channel, self.hvunit.get_polarity_all, self.hvunit.get_polarity)
+			if polarities is None:
+				return
+			for ch, polarity in zip(channels, polarities):
+				ch.polarity = polarity
+
+		elif parameter == 'limits': # refreshes the cached limits, see POLL_PERIODS
+			currents = self.readValues(channel, lambda: self.hvunit.get_current_limit_all(refresh=True), self.hvunit.get_current_limit)
+			voltages = None
+			if self.hvtype != 'mhv4': # not readable on the MHV-4
+				voltages = self.readValues(channel, lambda: self.hvunit.get_voltage_limit_all(refresh=True), self.hvunit.get_voltage_limit)
+			currents = currents or [None]*len(channels)
+			voltages = voltages or [None]*len(channels)
+			for ch, current, voltage in zip(channels, currents, voltages):
+				if current is not None: # the last reading is kept when it fails
+					ch.currentlimit = current
+				if voltage is not None:
+					ch.voltagelimit = voltage
+
+		elif parameter == 'alarm': # CAEN, one command for the whole board
+			alarm = self.hvunit.get_alarm(verbose=False)
+			if alarm < 0: # not read, e.g. no answer
+				return
+			new = alarm & ~self.alarm # the bits are latched until the operator clears them
+			self.alarm = alarm
+			if not new: # marked when it was new
+				return
+			print( "Alarm {a} on {t} unit {name}".format(a=alarm, t=self.hvtype, name=self.name) )
+			for ch in self.channels:
+				if new & (1 << ch.channel | BOARD_ALARM_BITS):
+					ch.alarmtime = now
+					self.send_to_influx(self.name, ch.channel, 'alarm', alarm)
+			for parameter in ('state', 'voltage', 'current'): # read everything at once, the GUI is updated by the listeners
+				self.poll(4, parameter)
+			return
+
+		elif parameter == 'events': # NHR, see pollPeriods()
+			events, module = self.hvunit.get_events_all()
+			if module < 0 or min(events) < 0: # not read, e.g. no answer, nothing is cleared or read
+				return
+			changed = [ str(ch.channel) for ch, event in zip(self.channels, events) if event != 0 ]
+			if not changed and module == 0:
+				return
+			if changed: # cleared before reading, so that a new event is seen next time
+				self.hvunit.clear_events(','.join(changed))
+			if module != 0:
+				self.hvunit.clear_module_events()
+			self.poll(4, 'state')
+			self.poll(4, 'voltage')
+			return
+
+		self.adaptPolls()
+		for listener in self.listeners:
+			listener(channel)
+
+	def pollPeriods(self, mode):
+		"""Returns the polling periods of the unit in the polling ``mode`` (see POLL_MODES).
+		With NHR_EVENT_POLLING the NHR units poll their event status registers at the
+		period of the state instead, and read the state and the voltages only when an
+		event was seen, or every NHR_REFRESH_TIME. They are polled as usual while active."""
+		periods = dict(POLL_PERIODS)
+		periods.update(POLL_MODES[mode])
+		if self.hvtype == 'nhr' and NHR_EVENT_POLLING and mode == 'active':
+			periods['events'] = NHR_REFRESH_TIME # the state is read anyway
+		elif self.hvtype == 'nhr' and NHR_EVENT_POLLING:
+			periods['events'] = periods['state']
+			periods['state'] = periods['voltage'] = NHR_REFRESH_TIME
+		if self.hvtype == 'n1419':
+			periods['alarm'] = ALARM_POLL_TIME # trips are seen within a second in all modes
+		return periods
+
+	def schedulePolls(self, scheduler):
+		"""Register the periodic reads of all channels of the unit with ``scheduler``."""
+		self.scheduler = scheduler
+		self.pollmode = 'normal'
+		for parameter, period in self.pollPeriods(self.pollmode).items():
+			scheduler.add(self, 4, parameter, period)
+
+	def adaptPolls(self):
+		"""Choose the polling periods of the unit (see POLL_MODES) from the state of its
+		channels: 'active' while a channel ramps, changes or had an alarm, 'steady' when
+		none of them changed for STEADY_TIME. Each read covers all channels, so the
+		busiest channel sets the rate of the unit."""
+		if self.scheduler is None:
+			return
+		now = time.monotonic()
+		if any( ch.ramping or now - ch.lastactive < ACTIVE_HOLD_TIME or
+				( ch.alarmtime is not None and now - ch.alarmtime < ALARM_HOLD_TIME ) for ch in self.channels ):
+			mode = 'active'
+		elif all( now - ch.lastactive > STEADY_TIME for ch in self.channels ):
+			mode = 'steady'
+		else:
+			mode = 'normal'
+		if mode == self.pollmode:
+			return
+		self.pollmode = mode
+		for parameter, period in self.pollPeriods(mode).items():
+			self.scheduler.set_period(self, 4, parameter, period)
+
+	def markActive(self, channel):
+		"""Poll the unit fast for a while after we changed ``channel`` (4 for all)."""
+		for ch in self.channels if channel == 4 else [self.channels[channel]]:
+			ch.lastactive = time.monotonic()
+		self.adaptPolls()
+
+	def checkMHV4(self, channel, preset=None):
+		"""Keep the enabled state of an MHV-4 channel in line with its voltage, as the
+		unit does not report it. The preset voltage is read if it is not given."""
+		if self.channels[channel].enabled != 1: 
+			if self.channels[channel].voltage > 0.1:
+				self.channels[channel].enabled = 1
+			if preset is None:
+				preset = self.getVoltagePreset(channel)
+			if preset != 0:
+				self.setVoltage(channel,0)
+				self.channels[channel].setvoltage = 0
+		elif self.channels[channel].voltage == 0:
+			self.hvunit.set_off(channel)
+			self.channels[channel].enabled = 0
 
 	
 	#if the voltage of a channel is zero, it will be turned off when starting the GUI
@@ -312,24 +712,24 @@ class Unit:
 				return
 		self.channels[channel].enabled = 1
 		self.hvunit.set_on(channel)
-		time.sleep(0.8)
+		self.markActive(channel) # the state is read back soon by the polls
 	
 	def disableChannel(self,channel):
 		self.channels[channel].enabled = 0
 		self.hvunit.set_off(channel)
-		time.sleep(0.8)
+		self.markActive(channel)
 	
 	def setPolarity(self,channel,pol):
 		if self.hvtype == 'n1419':
 			print("Polarity must be changed on the board")
 			return
 		elif self.hvtype == 'nhr':
-			self.hvunit.set_voltage_polarity(channel,pol)	
+			self.setSetting(channel,'polarity',int(pol))
 			self.channels[channel].polarity = int(pol)
 		else:
 			curvoltage = self.getVoltage(channel)
 			if curvoltage < 0.1:
-				self.hvunit.set_voltage_polarity(channel,pol)	
+				self.setSetting(channel,'polarity',int(pol))
 				self.channels[channel].polarity = int(pol)
 			else:
 				print("Channel " + str(channel) + " is ON. Turn it off first.")
@@ -338,6 +738,11 @@ class Unit:
 		pol =  self.hvunit.get_polarity(channel)
 		self.channels[channel].polarity = pol
 		return pol		
+
+	def setSetting(self, channel, name, value):
+		"""Write a setting (see hvcache.SETTERS) of the channel, or of the whole unit for
+		channel None, unless the unit already has this value. Returns True if it was sent."""
+		return self.settings.write(self.hvunit, channel, name, value)
 	
 	def setVoltage(self,channel,voltage):
 		if voltage > VOLTAGE_LIMIT: 
@@ -345,16 +750,26 @@ class Unit:
 			return
 
 		if self.hvtype == 'n1419' or self.hvtype == 'nhr':
-			if int(RAMP_RATE_CAEN) < 1 or int(RAMP_RATE_CAEN) > 50:
-				print("Ramp rate must be between 1 V/s and 50 V/s. Currently = %s" % int(RAMP_RATE_CAEN) )
+			if int(RAMP_RATE_CAEN) < RAMP_RATES_CAEN[0] or int(RAMP_RATE_CAEN) > RAMP_RATES_CAEN[1]:
+				print("Ramp rate must be between %d V/s and %d V/s. Currently = %s" % (RAMP_RATES_CAEN[0], RAMP_RATES_CAEN[1], int(RAMP_RATE_CAEN)) )
 				return
-			self.hvunit.set_ramp_up(channel,int(RAMP_RATE_CAEN))
-			self.hvunit.set_ramp_down(channel,int(RAMP_RATE_CAEN))
+			self.setSetting(channel,'ramp_up',int(RAMP_RATE_CAEN)) # only sent if the unit has another ramp rate
+			self.setSetting(channel,'ramp_down',int(RAMP_RATE_CAEN))
 			self.hvunit.set_voltage(channel, voltage)
-			time.sleep(0.1)
-			self.updateValues(channel)		
+			self.channels[channel].setvoltage = voltage # the readings follow with the next poll
+			self.markActive(channel)
+
+		elif self.rampEngine is not None and MHV4_HARDWARE_RAMP is not None: # the MHV-4 ramps by itself, the RampEngine watches the current
+			self.setSetting(None,'ramp',MHV4_HARDWARE_RAMP) # only sent if the unit has another ramp speed
+			self.rampEngine.ramp(self, channel, voltage, rate=MHV4_RAMP_SPEEDS[MHV4_HARDWARE_RAMP], hardware=True)
+			self.channels[channel].setvoltage = voltage
+
+		elif self.rampEngine is not None: # go slowly for the MHV-4 modules, at RAMP_RATE_MHV4
+			self.rampEngine.ramp(self, channel, voltage)
+			self.channels[channel].setvoltage = voltage
 
 		else: # go slowly for the MHV-4 modules
+			self.markActive(channel)
 		
 			# Ramp voltage slowly up or down
 			curvoltage = self.getVoltage(channel)	
@@ -374,6 +789,31 @@ class Unit:
 			time.sleep(RAMP_WAIT_TIME)
 			self.updateValues(channel)		
 
+	def rampLimits(self):
+		"""Returns the (smallest, largest, resolution) of the ramp rates in V/s of the channels, see rampplanner."""
+		if self.hvtype == 'n1419' or self.hvtype == 'nhr':
+			return (RAMP_RATES_CAEN[0], RAMP_RATES_CAEN[1], 1) # only whole V/s
+		if MHV4_HARDWARE_RAMP is not None:
+			speed = MHV4_RAMP_SPEEDS[MHV4_HARDWARE_RAMP]
+			return (speed, speed, 0)
+		return (0, RAMP_RATE_MHV4, 0)
+
+	def rampVoltage(self, channel, voltage, rate, delay=0., start=None):
+		"""Ramp the channel at ``rate`` V/s (within rampLimits()) starting in ``delay`` s, without
+		waiting for it. The CAEN and NHR units and the MHV-4 in hardware ramp mode ramp by
+		themselves, supervised by the RampEngine, which ramps the MHV-4 otherwise.
+		Only the ramp rate of the direction of the ramp is changed on the CAEN and NHR units."""
+		if self.hvtype == 'mhv4' and MHV4_HARDWARE_RAMP is None:
+			self.rampEngine.ramp(self, channel, voltage, start=start, rate=rate, delay=delay)
+		else:
+			if self.hvtype == 'mhv4':
+				self.submit(portexecutor.CONTROL, self.setSetting, None, 'ramp', MHV4_HARDWARE_RAMP)
+			else: # sent before the setpoint of the RampEngine, which goes through the same lane
+				current = self.channels[channel].voltage if start is None else start
+				self.submit(portexecutor.CONTROL, self.setSetting, channel, 'ramp_up' if voltage > current else 'ramp_down', int(round(rate)))
+			self.rampEngine.ramp(self, channel, voltage, start=start, rate=rate, hardware=True, delay=delay)
+		self.channels[channel].setvoltage = voltage
+
 	def getVoltage(self,channel):
 		return abs(self.hvunit.get_voltage(channel))
 		
@@ -383,13 +823,10 @@ class Unit:
 	def getCurrent(self,channel):
 		return self.hvunit.get_current(channel)
 
-	# Send rates to Influx database
+	# Send rates to Influx database, queued for the sender thread as this runs on the port executor
 	def send_to_influx( self, name, channel,  meastype, value ):
-		try:
-			payload = 'hv,name=' + str(name) + ',channel=' + str(channel) + ',type=' + str(meastype) + ' value=' + str(value)
-			r = requests.post( 'https://dbod-iss.cern.ch:8080/write?db=hv', data=payload, auth=("admin","issmonitor"), verify=False )
-		except InsecureRequestWarning:
-			pass
+		if self.telemetry is not None:
+			self.telemetry.send(name, channel, meastype, value)
 
 			
 class ChannelView(wx.StaticBox):
@@ -401,7 +838,6 @@ class ChannelView(wx.StaticBox):
 		#For Enable/Disable, change Polarity (elements are put in the queue only if these values are false
 		self.EnDisable=False
 		self.changePol=False
-		self.changeVol=False
 
 		#Event Handlers
 		self.Bind(EVT_COUNT, self.voltageChange)
@@ -452,9 +888,8 @@ class ChannelView(wx.StaticBox):
 		
 		self.SetSizer(self.bsizer1)
 		
-		self.unit.myunit.updateValues() # Get initial values from the unit
 		self.wantedVoltage=self.unit.myunit.channels[self.number].voltage	
-		self.updateValues()               # Update GUI with the initial values
+		self.updateValues()               # Update GUI with the values read by bringUp()
 		
 	def updateValues(self):
 		setvoltage = self.unit.myunit.channels[self.number].setvoltage
@@ -480,6 +915,14 @@ class ChannelView(wx.StaticBox):
 		self.currentValue.SetValue(str(curcurrent))
 		self.polrb.SetSelection(curpolaritysel)
 		self.enablerb.SetSelection(curenablesel)
+		self.showStale()
+
+	def showStale(self):
+		"""Grey out the readings of the channel if its last read got no answer, they are older."""
+		stale = self.unit.myunit.channels[self.number].stale
+		colour = wx.SystemSettings.GetColour(wx.SYS_COLOUR_GRAYTEXT if stale else wx.SYS_COLOUR_WINDOWTEXT)
+		self.voltageValue.SetForegroundColour(colour)
+		self.currentValue.SetForegroundColour(colour)
 
 	def updateValuesEvent(self,evt3):
 		setvoltage = self.unit.myunit.channels[self.number].setvoltage
@@ -504,12 +947,19 @@ class ChannelView(wx.StaticBox):
 		self.currentValue.SetValue(str(curcurrent))
 		self.polrb.SetSelection(curpolaritysel)
 		self.enablerb.SetSelection(curenablesel)
+		self.showStale()
+		if not self.unit.myunit.isReachable(): # the last readings are not shown as if they were current
+			self.voltageValue.SetValue('offline')
+			self.currentValue.SetValue('offline')
 		
 	def OnClickSetVoltageButton(self, event):
 		newvoltage = float( self.setVoltageValue.GetValue() )
 		if newvoltage > VOLTAGE_LIMIT: 
 			print("Set voltage too high (limit is " + str(VOLTAGE_LIMIT) + " V).")
 			return
+		if not self.unit.myunit.isReachable():
+			print("Unit %s is offline, the voltage is not set" % self.unit.myunit.name)
+			return
 
 		if self.unit.myunit.hvtype == 'mhv4':
 			if self.unit.myunit.channels[self.number].enabled==0:
@@ -520,13 +970,11 @@ class ChannelView(wx.StaticBox):
 			self.wantedVoltage=newvoltage
 			self.presetValue.SetValue(str(newvoltage))
 			self.unit.myunit.channels[self.number].setvoltage = self.wantedVoltage		
-			if self.changeVol==False: #if the channel is not already in the voltage change queue, an element representing the channel is put in the queue
-				self.changeVol=True
-				self.unit.Vqueue.add(queues.Element(self.number))
+			self.unit.Vqueue.put((self.unit.myunit,self.number,'voltage'),newvoltage) #replaces a ramp of the channel that is still queued
 
 		else: # caen n1419 and iSeg NHR auto-ramps at 1 V/s
 			self.presetValue.SetValue(str(newvoltage))
-			self.unit.myunit.setVoltage(self.number,float(newvoltage))
+			self.unit.myunit.submit(portexecutor.CONTROL, self.unit.myunit.setVoltage, self.number, float(newvoltage))
 		
 
 	def voltageChange(self,evt):
@@ -547,7 +995,7 @@ class ChannelView(wx.StaticBox):
 			
 			curpolaritysel = 1 if (newpolarity == 0) else 0	# invert the selection that comes from the RadioBox !
 			self.polrb.SetSelection(curpolaritysel)		
-			self.unit.Pqueue.add(queues.Element2(self.number,0,newpolarity))
+			self.unit.Pqueue.put((self.unit.myunit,self.number,'polarity'),newpolarity)
 		
 		else:	# caen process
 			print("Cannot change polarity of the N1419 modules in software")
@@ -567,24 +1015,21 @@ class ChannelView(wx.StaticBox):
 
 		if self.unit.myunit.hvtype == 'mhv4':	# mesytec process		
 			if selection==1 and self.unit.myunit.channels[self.number].voltage>0:
-				self.wantedVoltage=0 #instead of turning the channel directly off an element is put in the voltage change queue changing the voltage to zero
-				if self.changeVol==False:
-					self.changeVol=True
-					print("Set voltage of unit %s channel %d to %.2f" % (self.unit.myunit.name, self.number, 0) )
-					self.unit.Vqueue.add(queues.Element(self.number))
+				self.wantedVoltage=0 #instead of turning the channel directly off the voltage is ramped to zero
+				print("Set voltage of unit %s channel %d to %.2f" % (self.unit.myunit.name, self.number, 0) )
+				self.unit.Vqueue.put((self.unit.myunit,self.number,'voltage'),0)
 			
 			else:
 				newvalue = 1 if (selection == 0) else 0 # invert the selection that comes from the RadioBox !
 				print("Set enable of unit %s channel %d to %d" % (self.unit.myunit.name, self.number, newvalue) )
 				self.unit.myunit.channels[self.number].enabled = newvalue
-				self.unit.Pqueue.add(queues.Element2(self.number,1,newvalue))
+				self.unit.Pqueue.put((self.unit.myunit,self.number,'enable'),newvalue)
 
 		else:	# caen and iSeg process
 			newvalue = 1 if (selection == 0) else 0 # invert the selection that comes from the RadioBox !
-			time.sleep(0.1)
 			print("Set enable of unit %s channel %d to %d" % (self.unit.myunit.name, self.number, newvalue) )
 			self.unit.myunit.channels[self.number].enabled = newvalue
-			self.unit.Pqueue.add(queues.Element2(self.number,1,newvalue))
+			self.unit.Pqueue.put((self.unit.myunit,self.number,'enable'),newvalue)
 			#if newvalue == 1:
 			#	self.unit.myunit.enableChannel(self.number)
 			#	self.enablerb.SetForegroundColour('#ff0000')
@@ -632,21 +1077,48 @@ class UnitView(wx.Panel):
 		self.unitNameLabel = wx.StaticText(self, label=self.myunit.name)
 		self.mhvPanSizer = wx.GridBagSizer()		
 		self.mhvPanSizer.Add(self.unitNameLabel, (0, 0), span=(0,2), flag=wx.ALIGN_CENTER)
+		self.allOffButton = wx.Button(self, -1, "ALL OFF")
+		self.allOffButton.SetToolTip(wx.ToolTip("Turn all channels OFF at once, ahead of any queued command"))
+		self.Bind(wx.EVT_BUTTON, self.OnClickAllOffButton, self.allOffButton)
+		self.mhvPanSizer.Add(self.allOffButton, (1, 1), flag=wx.EXPAND)
 		
 		self.channelViews = []
-		#VoltageChange Queue
-		self.Vqueue=queues.DoubleQueue()
-		#Queue for Polarity Changes and Enable/Disable
-		self.Pqueue=queues.DoubleQueue()
+		#Set when a command is put in one of the queues
+		self.work=threading.Event()
+		#VoltageChange Queue, wanted voltage by (unit, channel, 'voltage')
+		self.Vqueue=queues.CommandQueue(self.work)
+		#Queue for Polarity Changes and Enable/Disable, new value by (unit, channel, 'polarity' or 'enable')
+		self.Pqueue=queues.CommandQueue(self.work)
 		
 		for i in range(4):
 			self.channelViews.append(ChannelView(self,i))
 			self.mhvPanSizer.Add(self.channelViews[i], (2+i, 1))
 			
 		self.SetSizer(self.mhvPanSizer)
+		self.myunit.listeners.append(self.postUpdate) # readings from the PollScheduler
+		if self.myunit.scheduler is not None: # the queue depths are printed with the polling rates
+			self.myunit.scheduler.reporters.append(self.reportQueues)
 		#Thread Definition
 		self.updater=CheckAndUpdater(self)
 		self.updater.start()
+
+	def OnClickAllOffButton(self, event):
+		print("Turn all channels of unit %s OFF" % self.myunit.name)
+		for i in range(4): # the setpoints and ON clicks not started yet would turn the channels on again
+			self.Vqueue.discard((self.myunit,i,'voltage'))
+			self.Pqueue.discard((self.myunit,i,'enable'))
+		self.myunit.emergencyOff()
+
+	def reportQueues(self):
+		"""Print the numbers of the commands of the unit waiting for the CheckAndUpdater."""
+		print("{name}: {v} voltage and {p} enable/polarity commands queued".format(name=self.myunit.name, v=self.Vqueue.depth(), p=self.Pqueue.depth()))
+
+	def postUpdate(self, channel):
+		"""Tell the views of ``channel`` (all for 4) that its readings have changed.
+		Called from the thread of the port executor."""
+		for i in range(4) if channel == 4 else [channel]:
+			evt3 = Update(myUpdate, -1, 1)
+			wx.PostEvent(self.channelViews[i], evt3)
 	
 
 class HVGUI(wx.Frame):
@@ -664,19 +1136,78 @@ class HVGUI(wx.Frame):
 
 		panel = wx.Panel(self)
 		panel.SetBackgroundColour('#4f5049')
+		outer = wx.BoxSizer(wx.VERTICAL)
+		self.rampAllButton = wx.Button(panel, -1, "RAMP ALL")
+		self.rampAllButton.SetToolTip(wx.ToolTip("Ramp all channels that are ON to the values in their boxes, reaching them together"))
+		self.Bind(wx.EVT_BUTTON, self.OnClickRampAllButton, self.rampAllButton)
+		outer.Add(self.rampAllButton, 0, wx.ALL, 5)
 		vbox = wx.BoxSizer(wx.HORIZONTAL)
 		
+		self.unitViews = []
 		for myunit in self.myunits: # Create a view for each HV unit
-			vbox.Add(UnitView(panel, myunit), wx.ID_ANY, wx.EXPAND | wx.ALL, 5)
+			self.unitViews.append(UnitView(panel, myunit))
+			vbox.Add(self.unitViews[-1], wx.ID_ANY, wx.EXPAND | wx.ALL, 5)
+
+		outer.Add(vbox, 1, wx.EXPAND)
+		panel.SetSizer(outer)
+
+	def OnClickRampAllButton(self, event):
+		changes = []
+		for view in self.unitViews:
+			if not view.myunit.isReachable():
+				print("Unit %s is offline, its voltages are not set" % view.myunit.name)
+				continue
+			for channelView in view.channelViews:
+				try:
+					newvoltage = float( channelView.setVoltageValue.GetValue() )
+				except ValueError:
+					continue
+				ch = view.myunit.channels[channelView.number]
+				if ch.enabled != 1 or newvoltage == ch.setvoltage:
+					continue
+				channelView.wantedVoltage = newvoltage
+				channelView.presetValue.SetValue(str(newvoltage))
+				view.Vqueue.discard((view.myunit,channelView.number,'voltage')) # replaced by the group ramp
+				changes.append( (view.myunit, channelView.number, newvoltage) )
+		print("Ramp %d channels together" % len(changes))
+		if changes: # the ramps run on their own, the setting of the ramp rates waits for the ports
+			threading.Thread(target=rampGroup, args=(changes, GROUP_RAMP_TIME), daemon=True).start()
 
-		panel.SetSizer(vbox)
 
+def bringUp(units):
+	"""Connect the units and read their values, all at the same time as they sit on
+	independent ports (boards on the same port take turns on its executor), printing
+	the progress of each unit. Returns the units that came up, in the given order."""
+	def start(unit):
+		t0 = time.monotonic()
+		unit.connect()
+		print("{name}: connected to {port} after {t:.1f} s".format(name=unit.name, port=unit.port, t=time.monotonic()-t0))
+		unit.startCheck()
+		unit.submit(portexecutor.CONTROL, unit.updateValues).result() # on the executor, which counts the timeouts
+		print("{name}: values read after {t:.1f} s".format(name=unit.name, t=time.monotonic()-t0))
+
+	started = []
+	t0 = time.monotonic()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=BRINGUP_THREADS) as pool:
+		futures = { pool.submit(start, unit) : unit for unit in units }
+		for future in concurrent.futures.as_completed(futures):
+			unit = futures[future]
+			try:
+				future.result()
+				started.append(unit)
+			except Exception as e:
+				print("{name}: could not be started: {e!r}".format(name=unit.name, e=e))
+	print("{n} of {m} HV units started in {t:.1f} s".format(n=len(started), m=len(units), t=time.monotonic()-t0))
+	return [ unit for unit in units if unit in started ]
 
 def main():
 
 	# Disable warnings related to security certificate checks being bypassed	
 	urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
 
+	sender = telemetry.TelemetrySender(TELEMETRY_URL, auth=TELEMETRY_AUTH, timeout=TELEMETRY_TIMEOUT)
+	sender.start()
+
 	hvunits = []
 	hvunits.append(Unit(serial='1124',name='ArrayHV0',hvtype='n1419',board=0))
 	hvunits.append(Unit(serial='1115',name='ArrayHV1',hvtype='n1419',board=1))
@@ -691,53 +1222,38 @@ def main():
 
 	
 	print('Looking up ports for the HV units in (/dev/tty*) ...')
-	ports = list_ports.comports()
+	index = discovery.discover( set( unit.board for unit in hvunits if unit.hvtype == 'n1419' ), cache_file=DISCOVERY_CACHE ) # each port is identified once
 	foundhvunits = []
 	for unit in hvunits:
-		for port in ports:
-
-			# MHV-4 units have serial number in USB interface
-			if port.serial_number == unit.serial and unit.hvtype == 'mhv4': 
-				unit.port = port.device
-				print("Found MHV-4 unit (" + str(unit.serial) + "," + str(unit.name) + ") in port: " + str(unit.port) )
-				break
-
-			# NHR units have serial number in USB interface
-			elif port.serial_number == unit.serial and unit.hvtype == 'nhr': 
-				unit.port = port.device
-				print("Found NHR unit (" + str(unit.serial) + "," + str(unit.name) + ") in port: " + str(unit.port) )
-				break
-
-			# N1419 units have no serial number in USB, need to connect first
-			elif port.serial_number == None and ( port.manufacturer == 'FTDI' or port.manufacturer == 'CAEN SPA' ) and unit.hvtype == 'n1419':
-				tmpmod = n1419lib.N1419(port=port.device, baud=9600, board=unit.board)
-				if unit.serial == tmpmod.get_serial_number():
-					unit.port = port.device
-					print("Found N1419 unit (" + str(unit.serial) + "," + str(unit.name) + ") in port: " + str(unit.port) )
-					tmpmod.close()
-					break
-				tmpmod.close()
-
-
+		unit.port = discovery.find(index, unit.hvtype, unit.serial, unit.board) or ''
 		if unit.port == '':
 			print(str(unit.hvtype) + " unit (" + str(unit.serial) + "," + str(unit.name) + ") was not found.")	
 			#foundhvunits.append(unit) # UNCOMMENT HERE TO DEBUG AND TEST WITH 'DUMMY' UNITS
 		else:
+			print("Found " + HV_TYPE_NAMES[unit.hvtype] + " unit (" + str(unit.serial) + "," + str(unit.name) + ") in port: " + str(unit.port) )
+			unit.telemetry = sender
 			foundhvunits.append(unit)
-			unit.connect()
-			unit.startCheck()
-			unit.updateValues()
 
-			#unit.myunit.updateValues()
+	foundhvunits = bringUp(foundhvunits)
 	
 	if ( 0 == len(foundhvunits) ) :
 		print('No HV units found in any of the USB ports with the given serial numbers!')
 		print('Exiting....')
 		exit()
 
+	scheduler = pollscheduler.PollScheduler(report_time=POLL_REPORT_TIME)
+	engine = rampengine.RampEngine(rate=RAMP_RATE_MHV4, step=RAMP_VOLTAGE_STEP, current_excursion=RAMP_CURRENT_EXCURSION, tolerance=RAMP_VOLTAGE_STEP)
+	engine.start()
+	for unit in foundhvunits:
+		unit.schedulePolls(scheduler)
+		unit.rampEngine = engine
+
 	app = wx.App()
 	gui = HVGUI(None, 'HVGUI', foundhvunits)
 	gui.Show()
+	scheduler.start()
+	monitor = hotplug.DeviceMonitor(foundhvunits, poll_time=HOTPLUG_TIME, retry_time=HOTPLUG_RETRY_TIME, cache_file=DISCOVERY_CACHE)
+	monitor.start()
 	app.MainLoop()
 
 
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio versions of the HV unit libraries (CAEN N1419/NDT1471, iSeg NHR and
+Mesytec MHV-4), so that one event loop can drive every serial port at once:
+
+	units = [ await AsyncMHV4.open('/dev/ttyACM0'), await AsyncN1419.open('/dev/ttyUSB0', board=0) ]
+	voltages = await asyncio.gather( *[ unit.get_voltage_all() for unit in units ] )
+
+The methods are coroutines with the same names, arguments and return values as
+in the synchronous libraries, and build their commands and parse the replies
+with the same codecs. A command that is not answered within ``timeout`` seconds
+raises asyncio.TimeoutError, and a cancelled command leaves the port ready for
+the next one.
+
+The serial ports are read without blocking through loop.add_reader(), which
+needs a POSIX serial port and a selector event loop (the default on Linux).
+They are opened apart from the hvserial ones, so a port is used either by
+these drivers or by the synchronous ones.
+"""
+
+
+import asyncio
+import serial
+import fasteners
+import hvserial
+import caencodec
+import isegcodec
+import mhv4codec
+import n1419lib
+import nhrlib
+import mhv4lib_orig as mhv4lib
+
+_transports = {}	# tasks opening or holding the transports by port name
+
+class AsyncSerialTransport():
+	"""One open serial port read by the event loop, shared by every board behind it.
+	Use open_transport() and release() instead of creating it directly.
+	"""
+	def __init__(self,port,ser,filelock):
+		self.port = port
+		self.ser = ser
+		self.filelock = filelock
+		self.users = 0
+		self.loop = asyncio.get_running_loop()	# reads the port, also after release() outside of it
+		self._buffer = bytearray()
+		self._data = asyncio.Event()
+		self._lock = asyncio.Lock()
+		self._stale = False	# set when a reply was given up, it may still arrive
+		self.loop.add_reader(self.ser.fileno(), self._on_readable)
+
+	def _on_readable(self):
+		self._buffer += self.ser.read(self.ser.in_waiting or 1)
+		self._data.set()
+
+	async def read_line(self, deadline):
+		"""The coroutine returns the next line without its terminator, see hvserial.read_line().
+		Raises asyncio.TimeoutError if it is not complete at ``deadline`` (event loop time).
+		"""
+		while 1:
+			del self._buffer[:len(self._buffer) - len(self._buffer.lstrip(hvserial.TERMINATORS))]
+			ends = [ i for i in (self._buffer.find(b'\r'), self._buffer.find(b'\n')) if i >= 0 ]
+			if ends:
+				line = bytes(self._buffer[:min(ends)])
+				del self._buffer[:min(ends)+1]
+				return line
+			self._data.clear()
+			await asyncio.wait_for(self._data.wait(), deadline - self.loop.time())
+
+	async def _exchange(self, command, read, timeout):
+		async with self._lock:
+			if self._stale:
+				self.ser.reset_input_buffer()
+				del self._buffer[:]
+				self._stale = False
+			deadline = self.loop.time() + timeout
+			try:
+				self.ser.write( hvserial.encode(command) )
+				return await read(deadline)
+			except BaseException:
+				self._stale = True
+				raise
+			finally:
+				del self._buffer[:] # anything left after the reply is dropped, like a flush
+
+	async def transaction(self, command, lines=1, timeout=hvserial.COMMAND_TIMEOUT):
+		"""The coroutine sends ``command`` and returns the last of the ``lines`` lines of
+		the reply, see hvserial.transaction().
+		"""
+		async def read(deadline):
+			response = b''
+			for i in range(lines):
+				response = await self.read_line(deadline)
+			return response
+		return await self._exchange(command, read, timeout)
+
+	async def transaction_values(self, command, find, n=4, echo=True, timeout=hvserial.COMMAND_TIMEOUT):
+		"""The coroutine sends ``command`` and returns the list of the first ``n`` values found
+		in the reply by ``find``, see hvserial.transaction_values().
+		"""
+		async def read(deadline):
+			if echo:
+				await self.read_line(deadline)
+			values = []
+			while len(values) < n:
+				values += find( await self.read_line(deadline) )
+			return values[:n]
+		return await self._exchange(command, read, timeout)
+
+	def release(self):
+		"""The function drops one user of the port, closing it after the last one.
+		It can be called after the event loop stopped."""
+		self.users -= 1
+		if self.users > 0:
+			return
+		_transports.pop(self.port, None)
+		if not self.loop.is_closed():
+			self.loop.remove_reader(self.ser.fileno())
+		self.ser.close()
+		if self.filelock is not None:
+			self.filelock.release()
+
+async def _open(port, baud, lock_path, **kwargs):
+	filelock = None
+	if lock_path is not None:
+		filelock = fasteners.InterProcessLock(lock_path + port[4:] + '.lock')
+		loop = asyncio.get_running_loop()
+		if not await loop.run_in_executor(None, lambda: filelock.acquire(timeout=hvserial.LOCK_TIMEOUT)):
+			raise IOError('Lockfile could not be acquired for port ' + port)
+	ser = serial.Serial( port=port, baudrate=baud, timeout=0, **kwargs ) # reads never block
+	await asyncio.sleep(0.1) # Wait 100 ms after opening the port before sending commands
+	ser.reset_input_buffer()
+	return AsyncSerialTransport(port, ser, filelock)
+
+async def open_transport(port, baud, lock_path=None, **kwargs):
+	"""The coroutine returns the shared transport of ``port``, opening the port if no
+	other board is using it yet. Every call must be matched by a release().
+
+	:param port: The serial port device, e.g. /dev/ttyUSB0.
+	:param baud: The baud rate, only used when the port is opened.
+	:param lock_path: The directory of the inter-process lock file, None for no lock.
+	"""
+	opening = _transports.get(port)
+	if opening is None:
+		opening = asyncio.ensure_future(_open(port, baud, lock_path, **kwargs))
+		_transports[port] = opening
+	try:
+		transport = await asyncio.shield(opening)
+	except BaseException:
+		if opening.done() and _transports.get(port) is opening and opening.exception() is not None:
+			del _transports[port]
+		raise
+	transport.users += 1
+	return transport
+
+
+class AsyncUnit():
+	"""Common part of the asyncio HV unit drivers."""
+	lines = 1	# lines sent back for a command, 2 if the unit echoes it
+	lock_path = None
+	serial_options = {}
+
+	def __init__(self,transport,board=0):
+		self.transport = transport
+		self.port = transport.port
+		self.board = str(board)
+		self.timeout = hvserial.COMMAND_TIMEOUT # time allowed for the unit to answer a command
+
+	@classmethod
+	async def open(cls, port, baud=9600, board=0):
+		"""The coroutine connects to the unit at ``port`` and returns its driver."""
+		transport = await open_transport(port, baud, lock_path=cls.lock_path, **cls.serial_options)
+		return cls(transport, board)
+
+	def close(self):
+		"""The function releases the serial port connection attached to the unit."""
+		self.transport.release()
+
+	async def send_command(self, command=b'', timeout=None):
+		"""The coroutine sends a command to the unit and returns the response bytes.
+		Raises asyncio.TimeoutError if it is not answered within ``timeout`` seconds
+		(default self.timeout).
+		"""
+		if not command: return b''
+		if timeout is None: timeout = self.timeout
+		return await self.transport.transaction( command, lines=self.lines, timeout=timeout )
+
+
+class AsyncN1419(AsyncUnit):
+	"""asyncio version of n1419lib.N1419, see there for the methods.
+	get_status() and get_alarm() return the bits without printing them.
+	"""
+	lock_path = n1419lib.LOCK_PATH
+	serial_options = {'xonxoff': True}
+
+	async def _monitor(self, channel, par, cast=float, error=0., nomatch=0.):
+		response = await self.send_command( caencodec.monitor_command(self.board, channel, par) )
+		return caencodec.parse_value( response, cast, error=error, nomatch=nomatch )
+
+	async def _monitor_all(self, par, cast=float, error=0., nomatch=0.):
+		response = await self.send_command( caencodec.monitor_command(self.board, 4, par) )
+		return caencodec.parse_values( response, cast, error=error, nomatch=nomatch )
+
+	async def _set(self, channel, par, val):
+		response = await self.send_command( caencodec.set_command(self.board, channel, par, val) )
+		return response.decode('utf8')
+
+	async def set_on(self,channel):
+		if channel not in [0,1,2,3,4]: return
+		await self.send_command( caencodec.switch_command(self.board, channel, 'ON') )
+
+	async def set_off(self,channel):
+		if channel not in [0,1,2,3,4]: return
+		await self.send_command( caencodec.switch_command(self.board, channel, 'OFF') )
+
+	async def get_power(self,channel):
+		status = await self.get_status(channel)
+		if status < 0:
+			return -1
+		return status & 1
+
+	async def get_status(self,channel):
+		return await self._monitor(channel, 'STAT', int, error=-1, nomatch=-1)
+
+	async def get_voltage(self,channel):
+		return await self._monitor(channel, 'VMON')
+
+	async def get_voltage_preset(self,channel):
+		return await self._monitor(channel, 'VSET')
+
+	async def get_voltage_limit(self,channel):
+		return await self._monitor(channel, 'VMAX', error=None, nomatch=None)
+
+	async def get_current(self,channel):
+		return await self._monitor(channel, 'IMON')
+
+	async def get_current_limit(self,channel):
+		return await self._monitor(channel, 'ISET', error=None, nomatch=None)
+
+	async def get_ramp_up(self,channel):
+		return await self._monitor(channel, 'RUP', error=None, nomatch=None)
+
+	async def get_ramp_down(self,channel):
+		return await self._monitor(channel, 'RDW', error=None, nomatch=None)
+
+	async def get_trip_time(self,channel):
+		return await self._monitor(channel, 'TRIP', error=None, nomatch=None)
+
+	async def get_polarity(self,channel):
+		return await self._monitor(channel, 'POL', str, error='ERROR', nomatch='ERROR')
+
+	async def get_voltage_all(self):
+		return await self._monitor_all('VMON')
+
+	async def get_voltage_preset_all(self):
+		return await self._monitor_all('VSET')
+
+	async def get_current_all(self):
+		return await self._monitor_all('IMON')
+
+	async def get_status_all(self):
+		return await self._monitor_all('STAT', int, error=-1, nomatch=-1)
+
+	async def get_power_all(self):
+		return [ -1 if status < 0 else status & 1 for status in await self.get_status_all() ]
+
+	async def get_polarity_all(self):
+		return await self._monitor_all('POL', str, error='ERROR', nomatch='ERROR')
+
+	async def get_voltage_limit_all(self):
+		return await self._monitor_all('VMAX', error=None, nomatch=None)
+
+	async def get_current_limit_all(self):
+		return await self._monitor_all('ISET', error=None, nomatch=None)
+
+	async def get_serial_number(self):
+		response = await self.send_command( caencodec.board_command(self.board, 'MON', 'BDSNUM') )
+		return caencodec.parse_value( response, str, error=None, nomatch=None )
+
+	async def get_alarm(self):
+		response = await self.send_command( caencodec.board_command(self.board, 'MON', 'BDALARM') )
+		return caencodec.parse_value( response, int, error=-1, nomatch=-1 )
+
+	async def clear_alarm(self):
+		response = await self.send_command( caencodec.board_command(self.board, 'SET', 'BDCLR') )
+		return response.decode('utf8')
+
+	async def set_voltage(self,channel, voltage):
+		if float(voltage) > n1419lib.VOLTAGE_LIMIT: # safety check limit in the library
+			return
+		return await self._set(channel, 'VSET', voltage)
+
+	async def set_current_limit(self,channel, limit):
+		return await self._set(channel, 'ISET', limit)
+
+	async def set_voltage_limit(self,channel, limit):
+		return await self._set(channel, 'MAXV', limit)
+
+	async def set_ramp_up(self,channel, n):
+		if float(n) < 1.0 or float(n) > 50.0: return
+		return await self._set(channel, 'RUP', n)
+
+	async def set_ramp_down(self,channel, n):
+		if float(n) < 1.0 or float(n) > 50.0: return
+		return await self._set(channel, 'RDW', n)
+
+	async def set_trip_time(self,channel, t):
+		if float(t) < 0.0 or float(t) > 1000.0: return
+		return await self._set(channel, 'TRIP', t)
+
+
+class AsyncNDT1471(AsyncN1419):
+	"""asyncio version of ndt1471lib.NDT1471, same protocol as the N1419."""
+
+
+class AsyncNHR(AsyncUnit):
+	"""asyncio version of nhrlib.NHR, see there for the methods.
+	get_status() and get_module_status() return the bits without printing them.
+	"""
+	lines = 2	# the command is echoed
+	lock_path = nhrlib.LOCK_PATH
+
+	async def _query(self, query, channel=None):
+		return await self.send_command( isegcodec.query_command(query, channel) )
+
+	async def _query_all(self, query, parse, default):
+		response = await self._query(query, isegcodec.CHANNELS)
+		return isegcodec.parse_all( isegcodec.split_answers(response)[0], parse, default )
+
+	async def _set(self, command, value, channel):
+		response = await self.send_command( isegcodec.set_command(command, value, channel) )
+		return response.decode('utf8').strip('\n').strip('\r')
+
+	async def set_on(self,channel):
+		if channel not in [0,1,2,3]: return
+		await self.send_command( isegcodec.switch_command('ON', channel) )
+
+	async def set_off(self,channel):
+		if channel not in [0,1,2,3]: return
+		await self.send_command( isegcodec.switch_command('OFF', channel) )
+
+	async def get_power(self,channel):
+		return isegcodec.parse_int( await self._query(':READ:VOLT:ON?', channel) )
+
+	async def get_voltage(self,channel):
+		return isegcodec.parse_float( await self._query(':MEAS:VOLT?', channel) )
+
+	async def get_voltage_preset(self,channel):
+		return isegcodec.parse_float( await self._query(':READ:VOLT?', channel) )
+
+	async def get_voltage_limit(self,channel):
+		return isegcodec.parse_float( await self._query(':READ:VOLT:LIM?', channel), None )
+
+	async def get_current(self,channel):
+		return isegcodec.parse_float( await self._query(':MEAS:CURR?', channel) ) * 1e6 # output is in A, we need uA
+
+	async def get_current_limit(self,channel):
+		limit = isegcodec.parse_float( await self._query(':READ:CURR?', channel), None )
+		return None if limit is None else limit * 1e6 # output is in A, we need uA
+
+	async def get_ramp_up(self,channel):
+		return isegcodec.parse_float( await self._query(':CONF:RAMP:UP?', channel), None )
+
+	async def get_ramp_down(self,channel):
+		return isegcodec.parse_float( await self._query(':CONF:RAMP:DOWN?', channel), None )
+
+	async def get_trip_time(self,channel):
+		return isegcodec.parse_float( await self._query(':CONF:TRIP:TIME?', channel), None )
+
+	async def get_polarity(self,channel):
+		return isegcodec.parse_polarity( await self._query(':CONF:OUTP:POL?', channel) )
+
+	async def get_voltage_all(self):
+		return await self._query_all(':MEAS:VOLT?', isegcodec.parse_float, 0.)
+
+	async def get_voltage_preset_all(self):
+		return await self._query_all(':READ:VOLT?', isegcodec.parse_float, 0.)
+
+	async def get_current_all(self):
+		return [ i * 1e6 for i in await self._query_all(':MEAS:CURR?', isegcodec.parse_float, 0.) ] # output is in A, we need uA
+
+	async def get_power_all(self):
+		return await self._query_all(':READ:VOLT:ON?', isegcodec.parse_int, -1)
+
+	async def get_polarity_all(self):
+		return await self._query_all(':CONF:OUTP:POL?', isegcodec.parse_polarity, -1)
+
+	async def get_voltage_limit_all(self):
+		return await self._query_all(':READ:VOLT:LIM?', isegcodec.parse_float, None)
+
+	async def get_current_limit_all(self):
+		limits = await self._query_all(':READ:CURR?', isegcodec.parse_float, None)
+		return [ None if i is None else i * 1e6 for i in limits ] # output is in A, we need uA
+
+	async def get_status_all(self):
+		return await self._query_all(':READ:CHAN:STAT?', isegcodec.parse_int, -1)
+
+	async def get_events_all(self):
+		return isegcodec.parse_events( await self.send_command( isegcodec.EVENT_COMMAND ) )
+
+	async def clear_events(self, channel=isegcodec.CHANNELS):
+		await self.send_command( isegcodec.clear_events_command(channel) )
+
+	async def clear_module_events(self):
+		await self.send_command( isegcodec.clear_events_command() )
+
+	async def get_serial_number(self):
+		return str( (await self._query(':SYS:USER:SERIAL?')).decode('utf8') )
+
+	async def get_status(self,channel):
+		return isegcodec.parse_int( await self._query(':READ:CHAN:STAT?', channel) )
+
+	async def get_module_status(self):
+		return isegcodec.parse_int( await self._query(':READ:MOD:STAT?') )
+
+	async def set_voltage(self,channel, voltage):
+		if float(voltage) > nhrlib.VOLTAGE_LIMIT: # safety check limit in the library
+			return
+		return await self._set(':VOLT', voltage, channel)
+
+	async def set_voltage_polarity(self,channel, pol):
+		if pol == 0:
+			polset = 'n'
+		elif pol == 1:
+			polset = 'p'
+		else:
+			return -1
+		return await self._set(':CONF:OUTP:POL', polset, channel)
+
+	async def set_current_limit(self,channel, limit):
+		return await self._set(':CURR', limit*1e-6, channel)
+
+	async def set_ramp_up(self,channel, n):
+		if float(n) < 1.0 or float(n) > 250.0: return
+		return await self._set(':CONF:RAMP:UP', n, channel)
+
+	async def set_ramp_down(self,channel, n):
+		if float(n) < 1.0 or float(n) > 50.0: return
+		return await self._set(':CONF:RAMP:DOWN', n, channel)
+
+	async def set_trip_time(self,channel, time):
+		if int(time) < 1 or int(time) > 4095: return
+		return await self._set(':CONF:TRIP:TIME', time, channel)
+
+
+class AsyncMHV4(AsyncUnit):
+	"""asyncio version of the MHV-4 driver (mhv4lib_orig.MHV4), see there for the methods.
+	The *_all methods raise asyncio.TimeoutError instead of returning default values."""
+	lines = 2	# the command is echoed
+
+	async def _all(self, name, find):
+		return await self.transport.transaction_values( mhv4codec.command(name, 4), find, n=4, echo=True, timeout=self.timeout )
+
+	async def set_on(self,channel):
+		if channel not in [0,1,2,3,4]: return
+		await self.send_command( mhv4codec.command('ON', channel) )
+
+	async def set_off(self,channel):
+		if channel not in [0,1,2,3,4]: return
+		await self.send_command( mhv4codec.command('OFF', channel) )
+
+	async def get_voltage(self,channel):
+		return mhv4codec.parse_signed( await self.send_command( mhv4codec.command('RU', channel) ) )
+
+	async def get_voltage_preset(self,channel):
+		return mhv4codec.parse_signed( await self.send_command( mhv4codec.command('RUP', channel) ) )
+
+	async def get_current(self,channel):
+		return mhv4codec.parse_signed( await self.send_command( mhv4codec.command('RI', channel) ) )
+
+	async def get_current_limit(self,channel):
+		return mhv4codec.parse_signed( await self.send_command( mhv4codec.command('RIL', channel) ), None )
+
+	async def get_polarity(self,channel):
+		return mhv4codec.parse_polarity( await self.send_command( mhv4codec.command('RP', channel) ) )
+
+	async def get_voltage_all(self):
+		return await self._all('RU', mhv4codec.find_signed)
+
+	async def get_voltage_preset_all(self):
+		return await self._all('RUP', mhv4codec.find_signed)
+
+	async def get_current_all(self):
+		return await self._all('RI', mhv4codec.find_signed)
+
+	async def get_polarity_all(self):
+		return await self._all('RP', mhv4codec.find_polarity)
+
+	async def get_ramp(self):
+		return mhv4codec.parse_ramp( await self.send_command( mhv4codec.command('RRA') ) )
+
+	async def set_voltage(self,channel, voltage):
+		if voltage > mhv4lib.VOLTAGE_LIMIT: # safety check limit in the library
+			return
+		# MHV-4 protocol expects voltage in 0.1 V units
+		return (await self.send_command( mhv4codec.set_command('SU', channel, voltage*10) )).decode('utf8')
+
+	async def set_current_limit(self,channel, limit):
+		return (await self.send_command( mhv4codec.set_command('SIL', channel, limit) )).decode('utf8')
+
+	async def set_voltage_limit(self,channel, limit):
+		return (await self.send_command( mhv4codec.set_command('SUL', channel, limit*10) )).decode('utf8')
+
+	async def set_voltage_polarity(self,channel, pol):
+		return (await self.send_command( mhv4codec.set_command('SP', channel, pol) )).decode('utf8')
+
+	async def set_ramp(self, n):
+		if n not in [0,1,2,3]: return
+		return (await self.send_command( mhv4codec.command('SRA', n) )).decode('utf8')
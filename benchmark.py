@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing in the protocol codecs, which runs for every
+reply of the polling, and of the group ramp planner. Prints the time per
+call of each statement.
+
+python3 benchmark.py
+"""
+
+
+import timeit
+import numpy as np
+import caencodec
+import isegcodec
+import mhv4codec
+import rampplanner
+
+STATEMENTS = {
+	caencodec : [ "monitor_command('0', 1, 'VMON')",
+		"parse_value(b'#BD:00,CMD:OK,VAL:0123.4')",
+		"parse_values(b'#BD:00,CMD:OK,VAL:0123.4;0000.0;0050.1;0199.9')",
+		"parse_values(b'#BD:00,CMD:OK,VAL:00008;00001;00000;00003', int)" ],
+	isegcodec : [ "query_command(':MEAS:VOLT?', 1)",
+		"parse_float(b'1.23450E2V')",
+		"parse_all(split_answers(b'1.2E2V,0.0E0V,5.0E1V,2.0E2V')[0], parse_float, 0.)",
+		"parse_events(b'0,0,16,0;0')",
+		"parse_monitor(b'1E2V,0E0V,5E1V,2E2V;1E-6A,0E0A,2E-6A,3E-6A;1E2V,0E0V,5E1V,2E2V', b'1,0,1,1;n,p,n,n;8,0,24,8')" ],
+	mhv4codec : [ "command('RU', 1)",
+		"parse_signed(b'RU 1: -120.5 V')",
+		"find_signed(b'RU 4: +120.5 V, -0.0 V, +50.1 V, +199.9 V')",
+		"find_polarity(b'RP 4: positive, negative, positive, negative')" ],
+}
+
+def run(n=100000):
+	"""The function prints the time in us of one call of each statement, averaged over ``n`` calls."""
+	for codec, statements in STATEMENTS.items():
+		print( codec.__name__ )
+		for statement in statements:
+			t = timeit.timeit(statement, number=n, globals=vars(codec))/n
+			print( '{t:8.2f} us  {s}'.format(t=t*1e6, s=statement) )
+
+def run_planner(n=1000):
+	"""The function plans a group of ``n`` channels, half of them CAEN-like (whole V/s from 1 to 5),
+	prints how closely they finish together and the time of one rampplanner.plan()."""
+	rng = np.random.default_rng(0)
+	start = rng.uniform(0, 50, n)
+	target = rng.uniform(100, 300, n)
+	caen = np.arange(n) % 2 == 0
+	group = rampplanner.plan(start, target, max_rate=np.where(caen, 5, 2), min_rate=np.where(caen, 1, 0), resolution=np.where(caen, 1, 0))
+	print( 'rampplanner' )
+	print( '{d:.1f} s for all, finishing within {f:.2e} s'.format(d=group.duration, f=np.ptp(group.finish())) )
+	t = timeit.timeit(lambda: rampplanner.plan(start, target, 5, 1, 1), number=100)/100
+	print( '{t:8.2f} us  plan() of {n} channels'.format(t=t*1e6, n=n) )
+
+
+if __name__ == '__main__':
+	run()
+	run_planner()
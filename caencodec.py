@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Codec of the CAEN N1419/NDT1471 serial protocol.
+
+Commands are '$BD:xx,CMD:MON,CH:x,PAR:xxx' lines and replies are
+'#BD:xx,CMD:OK,VAL:yy' lines. Channel 4 reads all channels at once, the
+reply then carrying the four values separated by ';'.
+"""
+
+
+import re
+from functools import lru_cache
+
+_REPLY = re.compile(rb'#BD:(\d*),CMD:(\w*)(?:,VAL:([^,\s]*))?', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def monitor_command(board, channel, par):
+	"""The function returns the bytes of the command reading ``par`` of ``channel`` (4 for all)."""
+	return '$BD:{bd},CMD:MON,CH:{ch},PAR:{par}\r'.format(bd=board,ch=channel,par=par).encode('utf-8')
+
+@lru_cache(maxsize=None)
+def board_command(board, cmd, par):
+	"""The function returns the bytes of the board-wide command ``cmd`` (MON or SET) of ``par``."""
+	return '$BD:{bd},CMD:{cmd},PAR:{par}\r'.format(bd=board,cmd=cmd,par=par).encode('utf-8')
+
+@lru_cache(maxsize=None)
+def switch_command(board, channel, par):
+	"""The function returns the bytes of the command setting ``par`` (ON or OFF) of ``channel``."""
+	return '$BD:{bd},CMD:SET,CH:{ch},PAR:{par}\r'.format(bd=board,ch=channel,par=par).encode('utf-8')
+
+def set_command(board, channel, par, val):
+	"""The function returns the bytes of the command setting ``par`` of ``channel`` to ``val``.
+	Not cached, as the values vary.
+	"""
+	return '$BD:{bd},CMD:SET,CH:{ch},PAR:{par},VAL:{val}\r'.format(bd=board,ch=channel,par=par,val=val).encode('utf-8')
+
+def split_reply(response):
+	"""The function returns the (CMD, VAL) fields of a ``response`` from the unit as
+	strings, VAL being None if there is none.
+	Returns None if the response can not be read (e.g. no answer).
+	"""
+	pattern = _REPLY.match(response)
+	if pattern is None:
+		return None
+	value = pattern.group(3)
+	return pattern.group(2).decode('ascii'), None if value is None else value.decode('ascii')
+
+def parse_value(response, cast=float, error=0., nomatch=0.):
+	"""The function returns the VAL field of a ``response`` from the unit, converted with ``cast``.
+
+	:param error: Returned when the unit answers with an error instead of OK.
+	:param nomatch: Returned when the response can not be read (e.g. no answer).
+	"""
+	reply = split_reply(response)
+	if reply is None:
+		return nomatch
+	if reply[0] != 'OK':
+		print( reply[0] )
+		return error
+	try:
+		return cast(reply[1])
+	except (TypeError, ValueError):
+		return nomatch
+
+def parse_values(response, cast=float, error=0., nomatch=0.):
+	"""The function returns the list of the four channel values in the ``response``
+	to a CH:4 (all channels) command, where they are separated by ';'.
+	See parse_value() for the arguments, which here apply to each of the values.
+	"""
+	reply = split_reply(response)
+	if reply is None:
+		return [nomatch]*4
+	if reply[0] != 'OK':
+		print( reply[0] )
+		return [error]*4
+	values = (reply[1] or '').split(';')
+	if len(values) != 4:
+		return [nomatch]*4
+	try:
+		return [ cast(value) for value in values ]
+	except ValueError:
+		return [nomatch]*4
+
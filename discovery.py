@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Discovery of the serial ports of the HV units.
+
+The ports are listed once and each port is identified once: the MHV-4 and
+NHR units carry their serial number in the USB descriptor, the CAEN boards,
+which do not, are asked with one BDSNUM query per board address, all ports
+at the same time (see probe_caen()). The result is an index of what sits
+behind each port, which all units are looked up in with find().
+
+The boards found on each port are saved in a cache file, by the place of
+the port on the USB bus, its VID:PID and serial number, which stay the same
+between restarts while the device name may not. A port in the cache is
+only confirmed with one query of one board, and probed again if the
+answer differs.
+"""
+
+
+import time
+import json
+import concurrent.futures
+from serial.tools import list_ports
+import hvserial
+import n1419lib
+
+USB_SERIAL = 'usb'	# type of the ports identified by their USB serial number
+USB_SERIAL_TYPES = ('mhv4', 'nhr')	# units with their serial number in the USB descriptor
+CAEN_MANUFACTURERS = ('FTDI', 'CAEN SPA')	# USB manufacturers of the ports of the CAEN boards
+PROBE_TIMEOUT = 3	# time in s allowed for asking the CAEN boards on one port for their serial numbers
+CONFIRM_TIMEOUT = 1	# time in s allowed for confirming the boards of a port in the cache file
+
+def _ask(device, boards, timeout):
+	"""The function returns the dictionary of the serial numbers of the CAEN ``boards`` on
+	``device`` that answer within ``timeout`` s, asked one after the other."""
+	found = {}
+	deadline = time.monotonic() + timeout
+	modules = []
+	try:
+		for board in boards:
+			module = n1419lib.N1419(port=device, baud=9600, board=board) # opens the port for the first board
+			if module.transport is None:
+				break
+			modules.append(module)
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				break
+			module.timeout = min(module.timeout, remaining)
+			serial = module.get_serial_number()
+			if isinstance(serial, str):
+				found[board] = serial
+	finally:
+		for module in modules:
+			module.close()
+	return found
+
+def probe_caen(jobs, timeout=PROBE_TIMEOUT):
+	"""The function asks CAEN boards for their serial numbers, all ports at the same time
+	and the boards of one port in turn. A port that takes longer than ``timeout`` s,
+	e.g. as another program holds it, is left out.
+
+	:param jobs: Dictionary of the lists of the board addresses to ask for by port device.
+	:returns: Dictionary of the dictionaries of the serial numbers by board address
+		by port device, for the ports that were asked in time.
+	"""
+	results = {}
+	pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs)))
+	futures = { pool.submit(_ask, device, boards, timeout) : device for device, boards in jobs.items() }
+	done, pending = concurrent.futures.wait(futures, timeout=timeout + 2*hvserial.POLL_TIME) # a board not answering takes the whole timeout
+	for future in done:
+		try:
+			results[futures[future]] = future.result()
+		except Exception as e:
+			print("Port {port} could not be probed: {e!r}".format(port=futures[future], e=e))
+	for future in pending: # finishes in the background and releases the port
+		print("Port {port} did not answer within {t} s".format(port=futures[future], t=timeout))
+	pool.shutdown(wait=False)
+	return results
+
+def port_key(port):
+	"""The function returns the key of a list_ports.comports() entry in the cache file."""
+	return '{loc}|{vid}:{pid}|{sn}'.format(loc=port.location, vid=port.vid, pid=port.pid, sn=port.serial_number)
+
+def load_cache(path):
+	"""The function returns the contents of the cache file, empty if it can not be read."""
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def save_cache(path, cache):
+	"""The function writes the cache file."""
+	try:
+		with open(path, 'w') as f:
+			json.dump(cache, f, indent=1, sort_keys=True)
+	except OSError as e:
+		print("The discovery cache {path} could not be written: {e!r}".format(path=path, e=e))
+
+def discover(caen_boards=(), ports=None, cache_file=None):
+	"""The function identifies the serial ports and returns the index of the units behind
+	them: a dictionary of the lists of (type, serial, board) by port device. The type is
+	USB_SERIAL for the MHV-4 and NHR units (board None) and 'n1419' for the CAEN boards.
+
+	:param caen_boards: The CAEN board addresses to ask for on the ports without a USB serial number.
+	:param ports: The list_ports.comports() entries, listed by default.
+	:param cache_file: The file of the CAEN boards found before, None for probing all ports.
+	"""
+	if ports is None:
+		ports = list_ports.comports()
+	caen_boards = sorted(caen_boards)
+	cache = load_cache(cache_file) if cache_file else {}
+	index = {}
+	found = {}	# board serial numbers by board address by port device
+	keys = {}
+	confirm = {}	# the board to ask for and the expected answer by port device
+	for port in ports:
+		if port.serial_number is not None:
+			index[port.device] = [ (USB_SERIAL, port.serial_number, None) ]
+		elif port.manufacturer in CAEN_MANUFACTURERS and caen_boards:
+			keys[port.device] = port_key(port)
+			entry = cache.get(keys[port.device])
+			if entry is not None and set(caen_boards) <= set(entry['boards']): # the boards were all asked for before
+				boards = { board : serial for board, serial in entry['found'] if board in caen_boards }
+				board = min(boards) if boards else caen_boards[0]
+				confirm[port.device] = (board, boards.get(board), boards)
+
+	confirmed = probe_caen( { device : [board] for device, (board, serial, boards) in confirm.items() }, CONFIRM_TIMEOUT )
+	for device, (board, serial, boards) in confirm.items():
+		if device in confirmed and confirmed[device].get(board) == serial:
+			found[device] = boards
+	probe = [ device for device in keys if device not in found ]
+	if probe:
+		print("Probing {n} ports for the CAEN boards ...".format(n=len(probe)))
+		probed = probe_caen( { device : caen_boards for device in probe } )
+		for device, boards in probed.items():
+			found[device] = boards
+			cache[keys[device]] = { 'boards' : caen_boards, 'found' : sorted(boards.items()) }
+		if cache_file and probed:
+			save_cache(cache_file, cache)
+
+	for device in sorted(found):
+		for board, serial in sorted(found[device].items()):
+			index.setdefault(device, []).append( ('n1419', serial, board) )
+	return index
+
+def find(index, hvtype, serial, board=None):
+	"""The function returns the port device of the unit of type ``hvtype`` (mhv4, nhr
+	or n1419) with the ``serial`` number in the ``index`` of discover(), or None.
+
+	:param board: The board address of a CAEN unit.
+	"""
+	for device, units in index.items():
+		for kind, number, address in units:
+			if number != serial:
+				continue
+			if kind == USB_SERIAL and hvtype in USB_SERIAL_TYPES:
+				return device
+			if kind == hvtype and address == board:
+				return device
+	return None
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker of a HV unit that stops answering.
+
+A unit that does not answer costs the full command timeout for every
+query, so a few reads of all channels stall its port for tens of seconds.
+After a number of consecutive timeouts the circuit opens: the unit is no
+longer read, only probed with one cheap query at periods that double up
+to a limit, and the circuit closes again with the first answer.
+"""
+
+
+import threading
+
+class CircuitBreaker():
+	"""The health of one unit, fed with the outcome of its reads by record()."""
+	def __init__(self, threshold=3, backoff=2., max_backoff=60.):
+		"""
+		:param threshold: Number of consecutive timeouts that opens the circuit.
+		:param backoff: Period in s of the first probe of an open circuit.
+		:param max_backoff: Longest period in s between the probes.
+		"""
+		self.threshold = threshold
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.failures = 0	# consecutive timeouts
+		self.open = False
+		self.period = backoff	# of the next probe
+		self._lock = threading.Lock()
+
+	def record(self, answered, timeouts):
+		"""The function records a read that got ``answered`` answers and ``timeouts`` timeouts
+		(see hvserial.counts()). Returns True if the circuit opened, False if it closed,
+		None if it did not change.
+		"""
+		with self._lock:
+			if answered:
+				self.failures = 0
+				if self.open:
+					self.open = False
+					return False
+			elif timeouts:
+				self.failures += timeouts
+				if not self.open and self.failures >= self.threshold:
+					self.open = True
+					self.period = self.backoff
+					return True
+			return None
+
+	def next_period(self):
+		"""The function returns the period in s until the next probe of the open circuit,
+		doubling the one after it."""
+		with self._lock:
+			period = self.period
+			self.period = min(2*self.period, self.max_backoff)
+			return period
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Monitor of the USB serial ports of the HV units.
+
+The ports are listed every few seconds (sysfs on Linux, which costs no
+serial traffic). When the port of a unit disappears, e.g. as the unit was
+unplugged or power-cycled, the unit is taken offline: its reads, ramps and
+commands stop and its port is released, while the other units keep
+running. When new ports appear the offline units are looked for on them
+with the discovery module, and a unit that is found is connected and read
+again.
+"""
+
+
+import threading
+from serial.tools import list_ports
+import discovery
+
+class DeviceMonitor(threading.Thread):
+	"""Watches the ports of ``units``, see the module documentation.
+	A unit is a VoltageGUI.Unit: it has ``port``, ``hvtype``, ``serial``, ``board`` and
+	``online``, and is taken offline with ``goOffline()`` and back with ``reconnect(port)``.
+	"""
+	def __init__(self, units, poll_time=2., retry_time=30., cache_file=None):
+		"""
+		:param poll_time: Period in s of listing the ports.
+		:param retry_time: Period in s of looking for the offline units again when no port appeared.
+		:param cache_file: The discovery cache file of the CAEN boards, see discovery.discover().
+		"""
+		threading.Thread.__init__(self, name='DeviceMonitor', daemon=True)
+		self.units = units
+		self.poll_time = poll_time
+		self.retry_time = retry_time
+		self.cache_file = cache_file
+		self._stopped = threading.Event()
+
+	def stop(self):
+		"""The function stops the thread."""
+		self._stopped.set()
+
+	def run(self):
+		"""Overrides Thread.run. Don't call this directly its called internally
+		when you call Thread.start().
+		"""
+		known = set()
+		waited = 0.
+		while not self._stopped.wait(self.poll_time):
+			waited += self.poll_time
+			ports = list_ports.comports()
+			devices = set( port.device for port in ports )
+			for unit in self.units:
+				if unit.online and unit.port not in devices:
+					print( "Port {port} of {name} is gone".format(port=unit.port, name=unit.name) )
+					unit.goOffline()
+			offline = [ unit for unit in self.units if not unit.online ]
+			if offline and ( devices - known or waited >= self.retry_time ):
+				waited = 0.
+				self.reconnect(offline, ports)
+			known = devices
+
+	def reconnect(self, offline, ports):
+		"""The function looks for the ``offline`` units on the ports that are not in use
+		and reconnects the units that are found."""
+		used = set( unit.port for unit in self.units if unit.online )
+		free = [ port for port in ports if port.device not in used ]
+		boards = set( unit.board for unit in offline if unit.hvtype == 'n1419' )
+		index = discovery.discover(boards, free, self.cache_file)
+		for unit in offline:
+			port = discovery.find(index, unit.hvtype, unit.serial, unit.board)
+			if port is None:
+				continue
+			try:
+				unit.reconnect(port)
+			except Exception as e:
+				print( "{name} could not be reconnected on {port}: {e!r}".format(name=unit.name, port=port, e=e) )
+				unit.goOffline()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Caches between the GUI units and the HV unit drivers.
+
+SettingsCache keeps the last confirmed settings of the channels of one
+unit (ramp speeds, trip time, limits, polarity). A setting is written
+through to the unit only when it differs from the confirmed value, so
+re-applying the same ramp speed before each setpoint costs nothing.
+
+CachedDriver puts the cache in front of a driver: the slow-changing
+parameters are read from the unit only once their time to live (TTL) has
+passed, and our own writes update the cache, so the monitoring reads go
+to voltage and current.
+"""
+
+
+import time
+import threading
+
+# Driver method writing each setting, called as method(channel, value)
+SETTERS = {
+	'ramp_up' : 'set_ramp_up',
+	'ramp_down' : 'set_ramp_down',
+	'ramp' : 'set_ramp',	# whole MHV-4 unit, channel None
+	'trip_time' : 'set_trip_time',
+	'current_limit' : 'set_current_limit',
+	'voltage_limit' : 'set_voltage_limit',
+	'polarity' : 'set_voltage_polarity',
+}
+
+# Driver method reading each parameter, called as method(channel) or method() for channel None
+GETTERS = {
+	'ramp_up' : 'get_ramp_up',
+	'ramp_down' : 'get_ramp_down',
+	'ramp' : 'get_ramp',
+	'trip_time' : 'get_trip_time',
+	'current_limit' : 'get_current_limit',
+	'voltage_limit' : 'get_voltage_limit',
+	'polarity' : 'get_polarity',
+	'serial_number' : 'get_serial_number',
+}
+
+# Time to live of the cached values in s, None for values that never change.
+# Polarity only changes through our own writes or a switch on the CAEN boards.
+TTLS = {
+	'ramp_up' : 600,
+	'ramp_down' : 600,
+	'ramp' : 600,
+	'trip_time' : 600,
+	'current_limit' : 600,
+	'voltage_limit' : 600,
+	'polarity' : 300,
+	'serial_number' : None,
+}
+
+FAILED = (None, -1, 'ERROR', '') # values the drivers return when a reading fails, never cached
+
+def acknowledged(response):
+	"""The function returns True if the ``response`` of a driver to a write shows that the unit
+	accepted it: CMD:OK from the CAEN units, an answer without an error from the others.
+	An empty response is a write that timed out, which may not have arrived.
+	"""
+	if not isinstance(response, str) or not response.strip():
+		return False
+	if response.startswith('#BD'): # CAEN
+		return ',CMD:OK' in response
+	return 'ERR' not in response
+
+class SettingsCache():
+	"""The last confirmed settings of one unit by (channel, name), the names being
+	the keys of TTLS. A setting is confirmed when the unit acknowledges its write,
+	or when it is read back from the unit, and expires after its TTL.
+	"""
+	def __init__(self, ttls=TTLS):
+		self.ttls = ttls
+		self._values = {}	# (channel, name) -> (value, time.monotonic() of the confirmation)
+		self._lock = threading.Lock()
+
+	def get(self, channel, name, default=None):
+		"""The function returns the confirmed value of the setting, or ``default`` if it
+		is not known or has expired.
+		"""
+		with self._lock:
+			entry = self._values.get( (channel, name) )
+		if entry is None:
+			return default
+		ttl = self.ttls.get(name)
+		if ttl is not None and time.monotonic() - entry[1] > ttl:
+			return default
+		return entry[0]
+
+	def get_all(self, name, n=4):
+		"""The function returns the list of the confirmed values of ``name`` for the
+		``n`` channels, or None if any of them is not known.
+		"""
+		values = [ self.get(channel, name, FAILED) for channel in range(n) ]
+		if any( value is FAILED for value in values ):
+			return None
+		return values
+
+	def confirm(self, channel, name, value):
+		"""The function records ``value`` as the setting of the unit, e.g. after reading it back.
+		Failed readings (see FAILED) are not recorded.
+		"""
+		if value in FAILED:
+			return
+		with self._lock:
+			self._values[(channel, name)] = (value, time.monotonic())
+
+	def read(self, channel, name, getter, *args):
+		"""The function returns the setting from the cache, or reads it with ``getter(*args)``
+		if it is not known or has expired.
+		"""
+		value = self.get(channel, name, FAILED)
+		if value is FAILED:
+			value = getter(*args)
+			self.confirm(channel, name, value)
+		return value
+
+	def invalidate(self, channel=None, name=None):
+		"""The function forgets the matching settings, all of them by default,
+		so that the next write() is sent to the unit.
+		"""
+		with self._lock:
+			for key in list(self._values):
+				if (channel is None or key[0] == channel) and (name is None or key[1] == name):
+					del self._values[key]
+
+	def write(self, driver, channel, name, value):
+		"""The function sets ``name`` of ``channel`` to ``value`` with the driver method in
+		SETTERS, unless the unit already has this value. Returns True if the command
+		was sent and accepted, False if it was skipped or failed.
+
+		:param driver: The HV unit driver (or its DriverProxy).
+		:param channel: The channel number, None for a setting of the whole unit.
+		"""
+		if self.get(channel, name) == value:
+			return False
+		setter = getattr(driver, SETTERS[name])
+		if channel is None:
+			response = setter(value)
+		else:
+			response = setter(channel, value)
+		return self.written(channel, name, value, response)
+
+	def written(self, channel, name, value, response):
+		"""The function updates the cache after ``value`` was written to the setting, given the
+		``response`` of the driver. Returns True if the unit accepted the value, see acknowledged().
+		"""
+		if not acknowledged(response): # refused by the driver or the unit, or no answer
+			self.invalidate(channel, name)
+			return False
+		if channel == 4: # all channels of the unit
+			self.invalidate(name=name)
+			return True
+		self.confirm(channel, name, value)
+		return True
+
+
+class CachedDriver():
+	"""Wraps a HV unit driver (or its DriverProxy) so that the parameters in GETTERS are read
+	through ``settings``, and the writes of the parameters in SETTERS update it.
+	Everything else is passed on to the driver.
+	"""
+	def __init__(self,target,settings):
+		self.target = target
+		self.settings = settings
+		self._getters = { method : name for name, method in GETTERS.items() }
+		self._setters = { method : name for name, method in SETTERS.items() }
+
+	def __getattr__(self,name):
+		attr = getattr(self.target, name)
+		if name in self._getters:
+			return self._cached_getter(self._getters[name], attr)
+		if name in self._setters:
+			return self._cached_setter(self._setters[name], attr)
+		return attr
+
+	def _cached_getter(self, name, getter):
+		def call(channel=None):
+			if channel is None:
+				return self.settings.read(None, name, getter)
+			return self.settings.read(channel, name, getter, channel)
+		return call
+
+	def _cached_setter(self, name, setter):
+		def call(*args):
+			response = setter(*args)
+			channel = args[0] if len(args) > 1 else None
+			self.settings.written(channel, name, args[-1], response)
+			return response
+		return call
+
+	def _get_all(self, name, refresh=False):
+		values = None if refresh else self.settings.get_all(name)
+		if values is None:
+			values = getattr(self.target, GETTERS[name] + '_all')()
+			for channel, value in enumerate(values):
+				self.settings.confirm(channel, name, value)
+		return values
+
+	def get_polarity_all(self):
+		"""The function returns the cached polarities of all channels, read from the unit
+		with one command when any of them has expired.
+		"""
+		return self._get_all('polarity')
+
+	def get_current_limit_all(self, refresh=False):
+		"""The function returns the cached current limits of all channels like get_polarity_all().
+
+		:param refresh: True to read them from the unit even if they are still valid.
+		"""
+		return self._get_all('current_limit', refresh)
+
+	def get_voltage_limit_all(self, refresh=False):
+		"""The function returns the cached voltage limits of all channels like get_polarity_all().
+
+		:param refresh: True to read them from the unit even if they are still valid.
+		"""
+		return self._get_all('voltage_limit', refresh)
+
+	def get_monitor_all(self):
+		"""The function returns the monitoring values of all channels like the driver does,
+		leaving out the reading of the polarities while the cached ones are valid.
+		"""
+		polarities = self.settings.get_all('polarity')
+		values = self.target.get_monitor_all(polarity=polarities is None)
+		if 'polarity' in values:
+			for channel, pol in enumerate(values['polarity']):
+				self.settings.confirm(channel, 'polarity', pol)
+		else:
+			values['polarity'] = polarities
+		return values
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Serial port helpers shared by the HV unit libraries.
+
+All of the units (CAEN N1419/NDT1471, iSeg NHR and Mesytec MHV-4) answer
+with lines terminated by CR or CR LF, so a reply can be returned as soon as
+its terminator arrives instead of after a fixed wait.
+
+Several boards can sit behind one port (e.g. CAEN N1419 boards daisy-chained
+on the lbus), so the open ports are reference counted and shared.
+
+The transactions that were answered and that timed out are counted per
+thread, see counts(), so that the caller of a driver can tell a unit that
+does not answer from one that answers zero.
+"""
+
+
+import re
+import serial
+import time
+import threading
+import fasteners
+
+POLL_TIME = 0.05	# read timeout of the serial port, bounds how late an expired deadline is noticed
+COMMAND_TIMEOUT = 1.0	# default time allowed for the unit to answer one command
+TERMINATORS = b'\r\n'
+_TERMINATOR = re.compile(b'[\r\n]')
+LOCK_TIMEOUT = 5	# time to wait for another program to release the port
+
+_counts = threading.local()	# transactions answered and timed out by each thread
+
+def _count(answered):
+	if answered:
+		_counts.answered = getattr(_counts, 'answered', 0) + 1
+	else:
+		_counts.timeouts = getattr(_counts, 'timeouts', 0) + 1
+
+def counts():
+	"""The function returns the numbers of the transactions of the calling thread (e.g. a port
+	executor) that were answered and that timed out, since the thread started. The difference
+	of two calls tells whether the commands sent in between got their answers.
+	"""
+	return getattr(_counts, 'answered', 0), getattr(_counts, 'timeouts', 0)
+
+def read_line(ser, deadline, buffer):
+	"""The function reads one line from the serial port ``ser`` and returns it
+	without its terminator as soon as a CR or LF is received.
+	Empty lines (e.g. the LF following a CR) are skipped.
+	If the deadline passes first, whatever was received so far is returned.
+	The bytes waiting at the port are read at once, not one by one, so the
+	bytes after the line are kept in ``buffer`` for the next line of the reply.
+
+	:param ser: The open serial.Serial object, opened with a short timeout (POLL_TIME).
+	:param deadline: The time.monotonic() value after which to give up waiting.
+	:param buffer: The bytearray of the bytes received but not returned yet, empty for a new reply.
+	"""
+	while 1:
+		start = len(buffer) - len(buffer.lstrip(TERMINATORS))
+		end = _TERMINATOR.search(buffer, start)
+		if end is not None:
+			line = bytes(buffer[start:end.start()])
+			del buffer[:end.end()]
+			return line
+		if time.monotonic() >= deadline:
+			line = bytes(buffer[start:])
+			del buffer[:]
+			return line
+		buffer += ser.read(ser.in_waiting or 1) # waits up to POLL_TIME for the first byte
+
+def encode(command):
+	"""The function returns the bytes of ``command``, which may already be bytes (e.g. from a codec)."""
+	if isinstance(command, str):
+		return command.encode('utf-8')
+	return command
+
+def transaction(ser, command, lines=1, timeout=COMMAND_TIMEOUT):
+	"""The function writes ``command`` to the serial port and returns the last of
+	the ``lines`` lines read back, all within one deadline of ``timeout`` seconds.
+	Units that echo the command use ``lines=2``, the first line being the echo.
+
+	:param ser: The open serial.Serial object.
+	:param command: The command string or bytes, including its terminator.
+	:param lines: The number of lines the unit sends back for the command.
+	:param timeout: The time in seconds allowed for the complete answer.
+	"""
+	deadline = time.monotonic() + timeout
+	ser.write( encode(command) )
+	response = b''
+	buffer = bytearray() # anything left after the last line is dropped, like a flush
+	for i in range(lines):
+		response = read_line(ser, deadline, buffer)
+	_count( time.monotonic() < deadline ) # the lines came before the deadline
+	return response
+
+def transaction_values(ser, command, find, n=4, echo=True, timeout=COMMAND_TIMEOUT):
+	"""The function writes ``command`` to the serial port and returns the list of the
+	first ``n`` values found in the reply by ``find``, for answers that are spread over
+	several lines (e.g. one line per channel). Returns None if fewer than ``n`` values
+	arrive within ``timeout`` seconds.
+
+	:param find: The function that returns the list of the values in one line (bytes).
+	:param echo: True if the unit echoes the command before the answer.
+	"""
+	deadline = time.monotonic() + timeout
+	ser.write( encode(command) )
+	buffer = bytearray()
+	if echo:
+		read_line(ser, deadline, buffer)
+	values = []
+	while len(values) < n and time.monotonic() < deadline:
+		values += find( read_line(ser, deadline, buffer) )
+	_count( len(values) >= n )
+	if len(values) < n:
+		return None
+	return values[:n]
+
+
+_transports = {}	# open transports by port name
+_opening = {}	# locks held while a port is being opened, by port name
+_transports_lock = threading.Lock()
+
+class SerialTransport():
+	"""One open serial port, shared by every board address behind it.
+	A transaction holds the port for the write and the complete reply, so
+	commands for different boards on the same port never interleave.
+	Use open_transport() and release() instead of creating it directly.
+	"""
+	def __init__(self,port,baud,lock_path,**kwargs):
+		self.port = port
+		self.users = 0
+		self.ser = None
+		self._lock = threading.Lock()
+		self.filelock = None
+		if lock_path is not None:
+			lock_file = port[4:]+'.lock'
+			self.filelock = fasteners.InterProcessLock(lock_path + lock_file)
+			if not self.filelock.acquire(timeout=LOCK_TIMEOUT):
+				print('Lockfile could not be acquired for port ' + port)
+				return
+			print('Lockfile acquired successfully: ' + lock_path + lock_file )
+		self.ser = serial.Serial( port=port, baudrate=baud, timeout=POLL_TIME, **kwargs )
+		time.sleep(0.1) # Wait 100 ms after opening the port before sending commands
+		self.ser.flushInput() # Flush the input buffer of the serial port before sending any new commands
+		time.sleep(0.1)
+
+	def transaction(self, command, lines=1, timeout=COMMAND_TIMEOUT):
+		"""The function sends ``command`` and returns the reply, see transaction()."""
+		with self._lock:
+			return transaction(self.ser, command, lines, timeout)
+
+	def flush_input(self):
+		""" Flush the input buffer of the serial port.
+		"""
+		with self._lock:
+			self.ser.flushInput()
+
+	def release(self):
+		"""The function drops one user of the port, closing it after the last one.
+		The port is closed before it is unregistered, so that a new open_transport()
+		of the same port does not find it still open.
+		"""
+		with _transports_lock:
+			self.users -= 1
+			if self.users > 0:
+				return
+			self.ser.close()
+			if self.filelock is not None:
+				self.filelock.release()
+			if _transports.get(self.port) is self:
+				del _transports[self.port]
+
+def open_transport(port, baud, lock_path=None, **kwargs):
+	"""The function returns the shared transport of ``port``, opening the port if
+	no other board is using it yet. Every call must be matched by a release().
+	Returns None if the lock file of the port could not be acquired.
+
+	:param port: The serial port device, e.g. /dev/ttyUSB0.
+	:param baud: The baud rate, only used when the port is opened.
+	:param lock_path: The directory of the inter-process lock file, None for no lock.
+	"""
+	with _transports_lock:
+		opening = _opening.setdefault(port, threading.Lock())
+	with opening: # other ports are opened at the same time, the same port only once
+		with _transports_lock:
+			transport = _transports.get(port)
+			if transport is not None:
+				transport.users += 1
+				return transport
+		transport = SerialTransport(port, baud, lock_path, **kwargs) # waits for the lock file and the port to settle
+		if transport.ser is None:
+			return None
+		with _transports_lock:
+			_transports[port] = transport
+			transport.users += 1
+		return transport
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Codec of the iSeg NHR SCPI serial protocol.
+
+Queries are ':MEAS:VOLT? (@0)' lines and the answers are values like
+1.23450E2V, one per channel of the channel list (e.g. (@0-3)), separated
+by ',', and by ';' between queries chained in one line.
+"""
+
+
+import re
+from functools import lru_cache
+
+CHANNELS = '0-3' # SCPI channel list of all channels
+
+_FLOAT = re.compile(rb'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def query_command(query, channel=None):
+	"""The function returns the bytes of ``query`` (e.g. ':MEAS:VOLT?') for ``channel``,
+	which can be a SCPI channel list like CHANNELS, or None for a module query.
+	"""
+	if channel is None:
+		return '{q}\r\n'.format(q=query).encode('utf-8')
+	return '{q} (@{ch})\r\n'.format(q=query,ch=channel).encode('utf-8')
+
+@lru_cache(maxsize=None)
+def switch_command(state, channel):
+	"""The function returns the bytes of the command turning the voltage of ``channel`` ON or OFF."""
+	return ':VOLT {s},(@{ch})\r\n'.format(s=state,ch=channel).encode('utf-8')
+
+@lru_cache(maxsize=None)
+def clear_events_command(channel=None):
+	"""The function returns the bytes of the command clearing the event status of ``channel``,
+	which can be a SCPI channel list like '0,2', or of the module for None.
+	"""
+	if channel is None:
+		return b':CONF:EV CLEAR\r\n'
+	return ':EV CLEAR,(@{ch})\r\n'.format(ch=channel).encode('utf-8')
+
+def set_command(command, value, channel):
+	"""The function returns the bytes of the ``command`` (e.g. ':VOLT') setting ``channel`` to ``value``.
+	Not cached, as the values vary.
+	"""
+	return '{c} {v},(@{ch})\r\n'.format(c=command,v=value,ch=channel).encode('utf-8')
+
+# Queries for all channels chained in one line each, see parse_monitor()
+MONITOR_COMMANDS = (
+	':MEAS:VOLT? (@{chs});:MEAS:CURR? (@{chs});:READ:VOLT? (@{chs})\r\n'.format(chs=CHANNELS).encode('utf-8'),
+	':READ:VOLT:ON? (@{chs});:CONF:OUTP:POL? (@{chs});:READ:CHAN:STAT? (@{chs})\r\n'.format(chs=CHANNELS).encode('utf-8'),
+)
+
+# Event status registers of all channels and of the module, which latch trips, the end of
+# a ramp, limits etc. until they are cleared, chained in one line, see parse_events()
+EVENT_COMMAND = ':READ:CHAN:EV:STAT? (@{chs});:READ:MOD:EV:STAT?\r\n'.format(chs=CHANNELS).encode('utf-8')
+
+def parse_float(response, default=0.):
+	"""The function returns the number at the start of a ``response`` from the unit,
+	e.g. 1.23450E2V, or ``default`` if there is none.
+	"""
+	pattern = _FLOAT.match(response)
+	if pattern is not None:
+		return float(pattern.group(0))
+	else:
+		return default
+
+def parse_int(response):
+	"""The function returns the integer ``response`` of the unit, e.g. a status register."""
+	return int(response.strip())
+
+def parse_polarity(response):
+	"""The function returns 0 for a negative (n) and 1 for a positive (p) polarity ``response``, otherwise -1."""
+	polarity = response.strip()
+	if polarity == b'n':
+		return 0
+	elif polarity == b'p':
+		return 1
+	else:
+		return -1
+
+def split_answers(response, queries=1):
+	"""The function splits the ``response`` to ``queries`` queries chained with ';'
+	over a channel list into one list of channel values per query.
+	Missing answers are None.
+	"""
+	answers = [ answer.split(b',') for answer in response.strip().split(b';') ]
+	if len(answers) != queries:
+		return [None]*queries
+	return answers
+
+def parse_all(values, parse, default, n=4):
+	"""The function returns the list of the ``n`` channel ``values`` of an answer
+	converted with ``parse`` (e.g. parse_float), or ``n`` times ``default`` if
+	they can not be read.
+	"""
+	if values is None or len(values) != n:
+		return [default]*n
+	try:
+		return [ parse(value) for value in values ]
+	except ValueError:
+		return [default]*n
+
+def parse_monitor(measured, states):
+	"""The function returns the dictionary of the channel value lists in the
+	responses to the two MONITOR_COMMANDS: 'voltage', 'current' (uA),
+	'voltage_preset', 'power', 'polarity' and 'status'.
+	"""
+	voltage, current, preset = split_answers(measured, 3)
+	power, polarity, status = split_answers(states, 3)
+	return {
+		'voltage' : parse_all(voltage, parse_float, 0.),
+		'current' : [ i * 1e6 for i in parse_all(current, parse_float, 0.) ], # output is in A, we need uA
+		'voltage_preset' : parse_all(preset, parse_float, 0.),
+		'power' : parse_all(power, parse_int, -1),
+		'polarity' : parse_all(polarity, parse_polarity, -1),
+		'status' : parse_all(status, parse_int, -1),
+	}
+
+def parse_events(response):
+	"""The function returns the list of the channel event status values and the module event
+	status value in the response to EVENT_COMMAND, -1 for the values that can not be read.
+	"""
+	channels, module = split_answers(response, 2)
+	return parse_all(channels, parse_int, -1), parse_all(module, parse_int, -1, n=1)[0]
+
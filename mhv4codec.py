@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Codec of the Mesytec MHV-4 serial protocol.
+
+Commands are 'RU 0' style lines (channel 4 for all channels) and the
+answers are e.g. 'RU 0: +120.0 V', one line per channel for channel 4.
+The voltages are signed by the polarity of the channel.
+"""
+
+
+import re
+from functools import lru_cache
+
+_SIGNED = re.compile(rb'.*([+-])(\d*.\d*)', re.IGNORECASE)
+_SIGNED_ALL = re.compile(rb'([+-])\s*(\d+\.?\d*)')
+_RAMP = re.compile(rb'.*:.?(\d*).*V.*', re.IGNORECASE)
+_POLARITY_ALL = re.compile(rb'positive|negative')
+
+@lru_cache(maxsize=None)
+def command(name, channel=None):
+	"""The function returns the bytes of the command ``name`` (e.g. 'RU') for ``channel``,
+	None for a command of the whole unit (e.g. 'RRA').
+	"""
+	if channel is None:
+		return '{n}\r'.format(n=name).encode('utf-8')
+	return '{n} {ch:d}\r'.format(n=name,ch=channel).encode('utf-8')
+
+def set_command(name, channel, value):
+	"""The function returns the bytes of the command ``name`` (e.g. 'SU') setting ``channel``
+	to the integer ``value`` in the units of the protocol. Not cached, as the values vary.
+	"""
+	return '{n} {ch:d} {v:d}\r'.format(n=name,ch=channel,v=int(value)).encode('utf-8')
+
+def parse_signed(response, default=0.):
+	"""The function returns the signed value in a ``response`` from the unit, or ``default`` if there is none."""
+	pattern = _SIGNED.match(response)
+	if pattern is not None:
+		value = float(pattern.group(2))
+		if pattern.group(1) == b'-':
+			value = -value
+		return value
+	else :
+		return default
+
+def parse_polarity(response):
+	"""The function returns 1 for a positive and 0 for a negative polarity ``response``, otherwise None."""
+	if b'positive' in response:
+		return 1
+	if b'negative' in response:
+		return 0
+
+def parse_ramp(response):
+	"""The function returns the ramp speed in V/s in a ``response`` from the unit, or -1 if there is none."""
+	pattern = _RAMP.match(response)
+	if pattern is not None:
+		return float(pattern.group(1))
+	else :
+		return -1
+
+def find_signed(response):
+	"""The function returns the list of all signed values in a ``response`` line from the unit."""
+	return [ -float(value) if sign == b'-' else float(value) for sign, value in _SIGNED_ALL.findall(response) ]
+
+def find_polarity(response):
+	"""The function returns the list of all polarities (1 positive, 0 negative) in a ``response`` line from the unit."""
+	return [ 1 if pol == b'positive' else 0 for pol in _POLARITY_ALL.findall(response) ]
+
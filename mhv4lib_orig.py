@@ -13,14 +13,16 @@ __copyright__ = "2018 Joonas Konki"
 
 import serial
 import time
-import re
+import hvserial
+import mhv4codec
 
 VOLTAGE_LIMIT = 251
 
 class MHV4():
 	def __init__(self,port,baud):
 		self.port = port
-		self.ser = serial.Serial( port=self.port, baudrate=baud, timeout=1 )
+		self.timeout = hvserial.COMMAND_TIMEOUT # time allowed for the unit to answer a command
+		self.ser = serial.Serial( port=self.port, baudrate=baud, timeout=hvserial.POLL_TIME )
 		
 	def close(self):
 		"""The function closes and releases the serial port connection attached to the unit. 
@@ -28,16 +30,16 @@ class MHV4():
 		"""
 		self.ser.close()
 		
-	def send_command(self, command=''):
+	def send_command(self, command='', timeout=None):
 		"""The function sends a command to the unit and returns the response string. 
+		The response is returned as soon as it is complete, or after ``timeout``
+		seconds (default self.timeout) if the unit does not answer.
 
 		"""
-		if command == '': return ''
-		self.ser.write( bytes(command, 'utf8') ) # works better with older Python3 versions (<3.5)
+		if not command: return ''
+		if timeout is None: timeout = self.timeout
 		#print("The sent command is: ",command)		
-		time.sleep(0.1)
-		self.ser.readline() # read out echoed command
-		a=self.ser.readline() # return response from the unit
+		a = hvserial.transaction( self.ser, command, lines=2, timeout=timeout ) # first line is the echoed command
 		#print("The returned command is: ",a)
 		return a # return response from the unit
 			
@@ -49,7 +51,7 @@ class MHV4():
 		"""
 		
 		if channel not in [0,1,2,3,4]: return
-		response = self.send_command( 'ON %d\r' % channel )
+		response = self.send_command( mhv4codec.command('ON', channel) )
 		
 	def set_off(self,channel):
 		"""The function turns the voltage OFF for the given ``channel`` number. 
@@ -59,7 +61,7 @@ class MHV4():
 		"""
 		
 		if channel not in [0,1,2,3,4]: return
-		response = self.send_command( 'OFF %d\r' % channel )
+		response = self.send_command( mhv4codec.command('OFF', channel) )
 
 	def get_voltage(self,channel):
 		"""The function returns the measured voltage reading of the given ``channel`` number. 
@@ -71,20 +73,8 @@ class MHV4():
 		:param channel: The channel number of which the voltage reading is requested. 
 						The return value is positive or negative depending on the set polarity.
 		"""
-		response = self.send_command( 'RU %d\r' % channel )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'.*([+-])(\d*.\d*)', linestr, re.IGNORECASE)
-		
-		if pattern is not None:
-			voltage = float(pattern.group(2))
-			#print("The voltage is ")
-			#print (voltage)
-			#print(pattern.group(2))
-			if pattern.group(1) == '-':
-				voltage = -voltage
-			return voltage
-		else :
-			return 0.
+		response = self.send_command( mhv4codec.command('RU', channel) )
+		return mhv4codec.parse_signed( response )
 			
 	def get_voltage_preset(self,channel):
 		"""The function returns the preset voltage reading of the given ``channel`` number.
@@ -96,75 +86,89 @@ class MHV4():
 		:param channel: The channel number of which the preset voltage reading is requested. 
 						The return value is positive regardless of what the polarity is set to.
 		"""
-		response = self.send_command( 'RUP %d\r' % channel )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'.*([+-])(\d*.\d*)', linestr, re.IGNORECASE)
-		
-		if pattern is not None:
-			voltage = float(pattern.group(2))
-			if pattern.group(1) == '-':
-				voltage = -voltage
-			return voltage
-		else :
-			return 0.
+		response = self.send_command( mhv4codec.command('RUP', channel) )
+		return mhv4codec.parse_signed( response )
 			
 	def get_current(self,channel):
-		response = self.send_command( 'RI %d\r' % channel )
-		linestr = response.decode('utf8')		
-		pattern = re.match(r'.*([+-])(\d*.\d*)', linestr, re.IGNORECASE)
-		
-		if pattern is not None:
-			current = float(pattern.group(2))
-			if pattern.group(1) == '-':
-				current = -current
-			return current
-		else :
-			return 0.
+		response = self.send_command( mhv4codec.command('RI', channel) )
+		return mhv4codec.parse_signed( response )
 			
 	def get_current_limit(self,channel):
 		""" not tested !"""
-		response = self.send_command( 'RIL %d\r' % channel )
-		linestr = response.decode('utf8')		
-		pattern = re.match(r'.*([+-])(\d*.\d*)', linestr, re.IGNORECASE)
-		
-		if pattern is not None:
-			current = float(pattern.group(2))
-			if pattern.group(1) == '-':
-				current = -current
-			return current
-		else :
-			return 0.
+		response = self.send_command( mhv4codec.command('RIL', channel) )
+		return mhv4codec.parse_signed( response, None ) # None if it can not be read
 			
 	def get_polarity(self,channel):
-		response = self.send_command( 'RP %d\r' % channel )
-		polarity=response.decode('utf8')
-		if "positive" in polarity:
-			return 1
-		if "negative" in polarity:
-			return 0	
-		#return returnValue
+		response = self.send_command( mhv4codec.command('RP', channel) )
+		return mhv4codec.parse_polarity( response )
 		
+	def send_command_all(self, command, find, timeout=None):
+		"""The function sends an all-channels command (channel 4) and returns the list
+		of the four channel values that ``find`` finds in the lines of the response,
+		or None if they do not all arrive within ``timeout`` seconds (default self.timeout).
+		"""
+		if timeout is None: timeout = self.timeout
+		return hvserial.transaction_values( self.ser, command, find, n=4, echo=True, timeout=timeout )
+
+	def get_voltage_all(self):
+		"""The function returns the list of the measured voltages of all channels, read
+		with one command. The values are signed according to the polarity.
+		"""
+		return self.send_command_all( mhv4codec.command('RU', 4), mhv4codec.find_signed ) or [0.]*4
+
+	def get_voltage_preset_all(self):
+		"""The function returns the list of the preset voltages of all channels, read
+		with one command. Not in old firmware, see get_voltage_preset().
+		"""
+		return self.send_command_all( mhv4codec.command('RUP', 4), mhv4codec.find_signed ) or [0.]*4
+
+	def get_current_all(self):
+		"""The function returns the list of the measured currents of all channels, read with one command."""
+		return self.send_command_all( mhv4codec.command('RI', 4), mhv4codec.find_signed ) or [0.]*4
+
+	def get_current_limit_all(self):
+		"""The function returns the list of the current limits of all channels, read with one
+		command, or None for each of them if they can not be read. Not tested !
+		"""
+		return self.send_command_all( mhv4codec.command('RIL', 4), mhv4codec.find_signed ) or [None]*4
+
+	def get_polarity_all(self):
+		"""The function returns the list of the polarities (1 positive, 0 negative, None
+		unknown) of all channels, read with one command.
+		"""
+		return self.send_command_all( mhv4codec.command('RP', 4), mhv4codec.find_polarity ) or [None]*4
+
+	def get_monitor_all(self, polarity=True):
+		"""The function reads everything the GUI monitors for all four channels with
+		four commands and returns a dictionary of lists with one value per channel:
+		'voltage', 'current', 'voltage_preset' and 'polarity'.
+
+		:param polarity: False to leave out 'polarity' and save its command, e.g. when it is cached.
+		"""
+		values = {
+			'voltage' : self.get_voltage_all(),
+			'current' : self.get_current_all(),
+			'voltage_preset' : self.get_voltage_preset_all(),
+		}
+		if polarity:
+			values['polarity'] = self.get_polarity_all()
+		return values
+
 	def get_temp(self,inputc):
 		""" not tested ! Get temperature at given input"""
-		response = self.send_command( 'RT %d\r' % inputc )
+		response = self.send_command( mhv4codec.command('RT', inputc) )
 		return response.decode('utf8')
 	
 	def get_temp_comp(self,channel):
 		""" not tested ! Get complete settings for temperature compensation of 
 		given channel"""
-		response = self.send_command( 'RTC %d\r' % channel )
+		response = self.send_command( mhv4codec.command('RTC', channel) )
 		return response.decode('utf8')
 			
 	def get_ramp(self):
 		"""Get voltage ramp speed setting of the unit in V/s"""
-		response = self.send_command( 'RRA\r')
-		linestr = response.decode('utf8')		
-		pattern = re.match(r'.*:.?(\d*).*V.*', linestr, re.IGNORECASE)		
-		if pattern is not None:
-			ramp = float(pattern.group(1))
-			return ramp
-		else :
-			return -1
+		response = self.send_command( mhv4codec.command('RRA') )
+		return mhv4codec.parse_ramp( response )
 		
 		
 	def set_voltage(self,channel, voltage):
@@ -178,7 +182,7 @@ class MHV4():
 			return
 		
 		# MHV-4 protocol expects voltage in 0.1 V units
-		response = self.send_command( 'SU %d %d\r' % (channel, voltage*10) ) 
+		response = self.send_command( mhv4codec.set_command('SU', channel, voltage*10) ) 
 		return response.decode('utf8')
 		
 	def set_current_limit(self,channel, limit):
@@ -191,7 +195,7 @@ class MHV4():
 		"""
 		
 		# MHV-4 protocol expects current in nanoamps
-		response = self.send_command( 'SIL %d %d\r' % (channel, limit) )
+		response = self.send_command( mhv4codec.set_command('SIL', channel, limit) )
 		return response.decode('utf8')
 		
 	def set_voltage_limit(self,channel, limit):
@@ -203,7 +207,7 @@ class MHV4():
 		:param limit: The voltage limit value that is to be set for the channel in units of Volts.
 		"""
 		# MHV-4 protocol expects voltage in 0.1 V units
-		response = self.send_command( 'SUL %d %d\r' % (channel, limit*10) )
+		response = self.send_command( mhv4codec.set_command('SUL', channel, limit*10) )
 		return response.decode('utf8')
 		
 	def set_voltage_polarity(self,channel, pol):
@@ -222,7 +226,7 @@ class MHV4():
 		:param channel: The channel number that the polarity change is applied to.
 		:param pol: The desired polarity of the voltage for the channel 0 or 1.
 		"""
-		response = self.send_command( 'SP %d %d\r' % (channel, pol) )
+		response = self.send_command( mhv4codec.set_command('SP', channel, pol) )
 		return response.decode('utf8')
 		
 	def set_ramp(self, n):
@@ -236,6 +240,6 @@ class MHV4():
 		
 		if n not in [0,1,2,3]: return
 		
-		response = self.send_command( 'SRA %d\r' % (n) )
+		response = self.send_command( mhv4codec.command('SRA', n) )
 		return response.decode('utf8')
 		
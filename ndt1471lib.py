@@ -8,54 +8,44 @@ The input characters are echoed before the response from the unit.
 """
 
 
-import serial
-import time
-import re
-import fasteners
+import hvserial
+import caencodec
 
 VOLTAGE_LIMIT = 200
-LOCK_TIMEOUT = 5
 LOCK_PATH = '/tmp/'
 
 class NDT1471():
 	def __init__(self,port,baud,board):
+		self.timeout = hvserial.COMMAND_TIMEOUT # time allowed for the unit to answer a command
 		self.board = str(board) # lbus in the NDT1471 module
-		lock_file = port[4:]+'.lock'
-		self.lock = fasteners.InterProcessLock(LOCK_PATH + lock_file)
-		if self.lock.acquire(timeout=LOCK_TIMEOUT):
-			print('Lockfile acquired successfully: ' + LOCK_PATH + lock_file )
-			self.port = port
-			self.ser = serial.Serial( port=self.port, baudrate=baud, timeout=1, xonxoff=True )
-			time.sleep(0.1) # Wait 100 ms after opening the port before sending commands
-			self.ser.flushInput() # Flush the input buffer of the serial port before sending any new commands
-			time.sleep(0.1)
-		else:
-			print('Lockfile could not be acquired for port ' + port)
+		self.port = port
+		self.transport = hvserial.open_transport( port, baud, lock_path=LOCK_PATH, xonxoff=True ) # shared with other boards on the same port
+		if self.transport is None:
 			print('Is there another program using ndt1471lib ??')
 			return
+		self.ser = self.transport.ser
 
 
 	def close(self):
 		"""The function closes and releases the serial port connection attached to the unit.
 
 		"""
-		self.ser.close()
-		self.lock.release()
+		self.transport.release()
 
-	def send_command(self, command=''):
+	def send_command(self, command='', timeout=None):
 		"""The function sends a command to the unit and returns the response string.
+		The response is returned as soon as it is complete, or after ``timeout``
+		seconds (default self.timeout) if the unit does not answer.
 
 		"""
-		if command == '': return ''
-		self.ser.write( command.encode('utf-8') )
-		time.sleep(0.1)
-		#self.ser.readline() # read out echoed command (no echo in NDT1471)
-		return self.ser.readline() # return response from the unit
+		if not command: return ''
+		if timeout is None: timeout = self.timeout
+		return self.transport.transaction( command, lines=1, timeout=timeout ) # no echo in NDT1471
 
 	def flush_input_buffer(self):
 		""" Flush the input buffer of the serial port.
 		"""
-		self.ser.flushInput()
+		self.transport.flush_input()
 
 	def set_on(self,channel):
 		"""The function turns the voltage ON for the given ``board`` and ``channel`` number.
@@ -65,7 +55,7 @@ class NDT1471():
 		"""
 
 		if channel not in [0,1,2,3,4]: return
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:ON\r'.format(bd=self.board,ch=channel) )
+		response = self.send_command( caencodec.switch_command(self.board, channel, 'ON') )
 
 	def set_off(self,channel):
 		"""The function turns the voltage OFF for the given ``board`` and ``channel`` number.
@@ -75,7 +65,7 @@ class NDT1471():
 		"""
 
 		if channel not in [0,1,2,3,4]: return
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:OFF\r'.format(bd=self.board,ch=channel) )
+		response = self.send_command( caencodec.switch_command(self.board, channel, 'OFF') )
 
 	def get_power(self,channel):
 		"""The function returns the power status of the given ``channel`` number.
@@ -85,23 +75,11 @@ class NDT1471():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:STAT\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-		
-			if pattern.group(2) == 'OK':
-
-				status = int(pattern.group(3))
-				return status & 1
-					
-			else:
-				print( pattern.group(2) )
-				return -1
-
-		else:
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'STAT') )
+		status = caencodec.parse_value( response, int, error=-1, nomatch=-1 )
+		if status < 0:
 			return -1
+		return status & 1
 
 	def get_status(self,channel):
 		"""The function returns the status value of the given ``channel`` number.
@@ -110,55 +88,44 @@ class NDT1471():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:STAT\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*)', linestr, re.IGNORECASE)
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'STAT') )
+		status = caencodec.parse_value( response, int, error=-1, nomatch=-1 )
+		if status < 0:
+			return -1
 
-		if pattern is not None:
-		
-			if pattern.group(2) == 'OK':
-			
-				status = int(pattern.group(3))
-				if status & 8192:
-					print( "Ch{ch} has calibration error".format(ch=channel) )
-				if status & 4096:
-					print( "Ch{ch} is in INTERLOCK via front panel".format(ch=channel) )
-				if status & 2048:
-					print( "Ch{ch} is in KILL via front panel".format(ch=channel) )
-				if status & 1024:
-					print( "Ch{ch} is disabled".format(ch=channel) )
-				if status & 512:
-					print( "Ch{ch} is over temperature > 105˚C".format(ch=channel) )
-				if status & 256:
-					print( "Ch{ch} is over power > 0.11 W".format(ch=channel) )
-				if status & 128:
-					print( "Ch{ch} has tripped".format(ch=channel) )
-				if status & 64:
-					print( "Ch{ch} is in max voltage protection".format(ch=channel) )
-				if status & 32:
-					print( "Ch{ch} is under voltage".format(ch=channel) )
-				if status & 16:
-					print( "Ch{ch} is over voltage".format(ch=channel) )
-				if status & 8:
-					print( "Ch{ch} is over current".format(ch=channel) )
-				if status & 4:
-					print( "Ch{ch} is ramping DOWN".format(ch=channel) )
-				if status & 2:
-					print( "Ch{ch} is ramping UP".format(ch=channel) )
-				if status & 1:
-					print( "Ch{ch} is ON".format(ch=channel) )
-				else:
-					print( "Ch{ch} is OFF".format(ch=channel) )
-
-					
-				return status
-				
-			else:
-				print( pattern.group(2) )
-				return -1
-				
+		if status & 8192:
+			print( "Ch{ch} has calibration error".format(ch=channel) )
+		if status & 4096:
+			print( "Ch{ch} is in INTERLOCK via front panel".format(ch=channel) )
+		if status & 2048:
+			print( "Ch{ch} is in KILL via front panel".format(ch=channel) )
+		if status & 1024:
+			print( "Ch{ch} is disabled".format(ch=channel) )
+		if status & 512:
+			print( "Ch{ch} is over temperature > 105˚C".format(ch=channel) )
+		if status & 256:
+			print( "Ch{ch} is over power > 0.11 W".format(ch=channel) )
+		if status & 128:
+			print( "Ch{ch} has tripped".format(ch=channel) )
+		if status & 64:
+			print( "Ch{ch} is in max voltage protection".format(ch=channel) )
+		if status & 32:
+			print( "Ch{ch} is under voltage".format(ch=channel) )
+		if status & 16:
+			print( "Ch{ch} is over voltage".format(ch=channel) )
+		if status & 8:
+			print( "Ch{ch} is over current".format(ch=channel) )
+		if status & 4:
+			print( "Ch{ch} is ramping DOWN".format(ch=channel) )
+		if status & 2:
+			print( "Ch{ch} is ramping UP".format(ch=channel) )
+		if status & 1:
+			print( "Ch{ch} is ON".format(ch=channel) )
 		else:
-			return -1
+			print( "Ch{ch} is OFF".format(ch=channel) )
+
+
+		return status
 
 
 	def get_voltage(self,channel):
@@ -168,19 +135,8 @@ class NDT1471():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:VMON\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				voltage = float(pattern.group(3))
-				return voltage
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return 0.
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'VMON') )
+		return caencodec.parse_value( response, float, error=0., nomatch=0. )
 
 	def get_voltage_preset(self,channel):
 		"""The function returns the preset voltage reading of the given ``channel`` number.
@@ -189,19 +145,8 @@ class NDT1471():
 
 		:param channel: The channel number of which the preset voltage reading is requested.
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:VSET\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				voltage = float(pattern.group(3))
-				return voltage
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return 0.
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'VSET') )
+		return caencodec.parse_value( response, float, error=0., nomatch=0. )
 
 	def get_voltage_limit(self,channel):
 		"""The function returns the voltage max limit reading of the given ``channel`` number.
@@ -210,179 +155,161 @@ class NDT1471():
 
 		:param channel: The channel number of which the preset voltage reading is requested.
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:VMAX\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				voltage = float(pattern.group(3))
-				return voltage
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return 0.
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'VMAX') )
+		return caencodec.parse_value( response, float, error=None, nomatch=None ) # None if it can not be read
 
 	def get_current(self,channel):
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:IMON\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				current = float(pattern.group(3))
-				return current
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return 0.
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'IMON') )
+		return caencodec.parse_value( response, float, error=0., nomatch=0. )
 
 	def get_current_limit(self,channel):
 		""" not tested !"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:ISET\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				current = float(pattern.group(3))
-				return current
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return 0.
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'ISET') )
+		return caencodec.parse_value( response, float, error=None, nomatch=None ) # None if it can not be read
 
 	def get_ramp_up(self,channel):
 		"""Get voltage ramp up speed setting of the unit in V/s
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:RUP\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				ramp = float(pattern.group(3))
-				return ramp
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return -1
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'RUP') )
+		return caencodec.parse_value( response, float, error=None, nomatch=None ) # None if it can not be read
 
 	def get_ramp_down(self,channel):
 		"""Get voltage ramp down speed setting of the unit in V/s
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:RDW\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				ramp = float(pattern.group(3))
-				return ramp
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return -1
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'RDW') )
+		return caencodec.parse_value( response, float, error=None, nomatch=None ) # None if it can not be read
 
 	def get_trip_time(self,channel):
 		"""Get the trip time of the channel in s
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:TRIP\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*.\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				ramp = float(pattern.group(3))
-				return ramp
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return -1
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'TRIP') )
+		return caencodec.parse_value( response, float, error=None, nomatch=None ) # None if it can not be read
 
 	def get_polarity(self,channel):
 		"""Get the polarity of the channel
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( '$BD:{bd},CMD:MON,CH:{ch},PAR:POL\r'.format(bd=self.board,ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\w*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				pol = pattern.group(3)
-				return pol
-			else:
-				print( pattern.group(2) )
-				return 'ERROR'
-		else:
-			return 'ERROR'
+		response = self.send_command( caencodec.monitor_command(self.board, channel, 'POL') )
+		return caencodec.parse_value( response, str, error='ERROR', nomatch='ERROR' )
+
+	def get_voltage_all(self):
+		"""The function returns the list of the measured voltages of all four channels,
+		read with one command.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'VMON') )
+		return caencodec.parse_values( response, float, error=0., nomatch=0. )
+
+	def get_voltage_preset_all(self):
+		"""The function returns the list of the preset voltages of all four channels,
+		read with one command.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'VSET') )
+		return caencodec.parse_values( response, float, error=0., nomatch=0. )
+
+	def get_current_all(self):
+		"""The function returns the list of the measured currents of all four channels,
+		read with one command.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'IMON') )
+		return caencodec.parse_values( response, float, error=0., nomatch=0. )
+
+	def get_status_all(self):
+		"""The function returns the list of the status values of all four channels,
+		read with one command, see get_status() for the bits.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'STAT') )
+		return caencodec.parse_values( response, int, error=-1, nomatch=-1 )
+
+	def get_power_all(self):
+		"""The function returns the list of the power status of all four channels,
+		0 for OFF, 1 for ON and -1 if unknown, read with one command.
+		"""
+		return [ -1 if status < 0 else status & 1 for status in self.get_status_all() ]
+
+	def get_polarity_all(self):
+		"""The function returns the list of the polarities of all four channels,
+		read with one command.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'POL') )
+		return caencodec.parse_values( response, str, error='ERROR', nomatch='ERROR' )
+
+	def get_voltage_limit_all(self):
+		"""The function returns the list of the voltage max limits of all four channels,
+		read with one command, None for the values that can not be read.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'VMAX') )
+		return caencodec.parse_values( response, float, error=None, nomatch=None )
+
+	def get_current_limit_all(self):
+		"""The function returns the list of the current limits of all four channels,
+		read with one command, None for the values that can not be read.
+		"""
+		response = self.send_command( caencodec.monitor_command(self.board, 4, 'ISET') )
+		return caencodec.parse_values( response, float, error=None, nomatch=None )
+
+	def get_monitor_all(self, polarity=True):
+		"""The function reads everything the GUI monitors for all four channels with
+		five commands and returns a dictionary of lists with one value per channel:
+		'voltage', 'current', 'voltage_preset', 'power', 'polarity' and 'status'.
+
+		:param polarity: False to leave out 'polarity' and save its command, e.g. when it is cached.
+		"""
+		status = self.get_status_all()
+		values = {
+			'voltage' : self.get_voltage_all(),
+			'current' : self.get_current_all(),
+			'voltage_preset' : self.get_voltage_preset_all(),
+			'power' : [ -1 if st < 0 else st & 1 for st in status ],
+			'status' : status,
+		}
+		if polarity:
+			values['polarity'] = self.get_polarity_all()
+		return values
 
 	def get_serial_number(self):
 		"""Get the serial number of the board/module"""
-		response = self.send_command( '$BD:{bd},CMD:MON,PAR:BDSNUM\r'.format(bd=self.board) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\w*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				pol = str(pattern.group(3)).rstrip('\r')
-				return pol
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return -1
+		response = self.send_command( caencodec.board_command(self.board, 'MON', 'BDSNUM') )
+		return caencodec.parse_value( response, str, error=None, nomatch=None )
 
-	def get_alarm(self):
-		"""Get alarm status from the board"""
-		response = self.send_command( '$BD:{bd},CMD:MON,PAR:BDALARM\r'.format(bd=self.board) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'#BD:(\d*),CMD:(\w*),VAL:(\d*)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			if pattern.group(2) == 'OK':
-				alarm = int(pattern.group(3))
-				
-				if alarm & 64:
-					print( "Internal HV clock FAIL" )
-				if alarm & 32:
-					print( "Board in OVER POWER" )
-				if alarm & 16:
-					print( "Board in POWER FAIL" )
-				if alarm & 8:
-					print( "Ch3 in Alarm status" )
-				if alarm & 4:
-					print( "Ch2 in Alarm status" )
-				if alarm & 2:
-					print( "Ch1 in Alarm status" )
-				if alarm & 1:
-					print( "Ch0 in Alarm status" )
-					
-				return alarm;
-
-			else:
-				print( pattern.group(2) )
-				return 0.
-		else:
-			return -1
+	def get_alarm(self, verbose=True):
+		"""Get alarm status from the board, bits 0 to 3 for the channels in alarm,
+		16 power fail, 32 over power and 64 HV clock fail, -1 if it can not be read.
+		The bits stay set until clear_alarm().
+
+		:param verbose: Print the alarms that are set.
+		"""
+		response = self.send_command( caencodec.board_command(self.board, 'MON', 'BDALARM') )
+		alarm = caencodec.parse_value( response, int, error=-1, nomatch=-1 )
+		if alarm <= 0 or not verbose:
+			return alarm
+
+		if alarm & 64:
+			print( "Internal HV clock FAIL" )
+		if alarm & 32:
+			print( "Board in OVER POWER" )
+		if alarm & 16:
+			print( "Board in POWER FAIL" )
+		if alarm & 8:
+			print( "Ch3 in Alarm status" )
+		if alarm & 4:
+			print( "Ch2 in Alarm status" )
+		if alarm & 2:
+			print( "Ch1 in Alarm status" )
+		if alarm & 1:
+			print( "Ch0 in Alarm status" )
+
+		return alarm
 
 	def clear_alarm(self):
 		"""Clear alarm status from the board"""
-		response = self.send_command( '$BD:{bd},CMD:SET,PAR:BDCLR\r'.format(bd=self.board) )
+		response = self.send_command( caencodec.board_command(self.board, 'SET', 'BDCLR') )
 		return response.decode('utf8')
 
 	def set_voltage(self,channel, voltage):
@@ -396,7 +323,7 @@ class NDT1471():
 			return
 
 		#
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:VSET,VAL:{val}\r'.format(bd=self.board,ch=channel,val=voltage) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'VSET', voltage) )
 		return response.decode('utf8')
 
 	def set_current_limit(self,channel, limit):
@@ -408,7 +335,7 @@ class NDT1471():
 		:param limit: The current limit value that is to be set for the channel in units of nA.
 		"""
 
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:ISET,VAL:{val}\r'.format(bd=self.board,ch=channel,val=limit) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'ISET', limit) )
 		return response.decode('utf8')
 
 	def set_voltage_limit(self,channel, limit):
@@ -420,7 +347,7 @@ class NDT1471():
 		:param limit: The voltage limit value that is to be set for the channel in units of Volts.
 		"""
 		
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:MAXV,VAL:{val}\r'.format(bd=self.board,ch=channel,val=limit) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'MAXV', limit) )
 		return response.decode('utf8')
 
 
@@ -433,7 +360,7 @@ class NDT1471():
 
 		if float(n) < 1.0 or float(n) > 50.0: return
 
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:RUP,VAL:{val}\r'.format(bd=self.board,ch=channel,val=n) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'RUP', n) )
 		return response.decode('utf8')
 
 	def set_ramp_down(self,channel, n):
@@ -445,7 +372,7 @@ class NDT1471():
 
 		if float(n) < 1.0 or float(n) > 50.0: return
 
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:RDW,VAL:{val}\r'.format(bd=self.board,ch=channel,val=n) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'RDW', n) )
 		return response.decode('utf8')
 
 	def set_trip_time(self,channel, t):
@@ -457,5 +384,5 @@ class NDT1471():
 
 		if float(t) < 0.0 or float(t) > 1000.0: return
 
-		response = self.send_command( '$BD:{bd},CMD:SET,CH:{ch},PAR:TRIP,VAL:{val}\r'.format(bd=self.board,ch=channel,val=t) )
+		response = self.send_command( caencodec.set_command(self.board, channel, 'TRIP', t) )
 		return response.decode('utf8')
@@ -8,54 +8,43 @@ The input characters are echoed before the response from the unit.
 """
 
 
-import serial
-import time
-import re
-import fasteners
+import hvserial
+import isegcodec
 
 VOLTAGE_LIMIT = 200
-LOCK_TIMEOUT = 5
 LOCK_PATH = '/tmp/'
-
 class NHR():
 	def __init__(self,port,baud,board):
+		self.timeout = hvserial.COMMAND_TIMEOUT # time allowed for the unit to answer a command
 		self.board = str(board) # lbus in the module
-		lock_file = port[4:]+'.lock'
-		self.lock = fasteners.InterProcessLock(LOCK_PATH + lock_file)
-		if self.lock.acquire(timeout=LOCK_TIMEOUT):
-			print('Lockfile acquired successfully: ' + LOCK_PATH + lock_file )
-			self.port = port
-			self.ser = serial.Serial( port=self.port, baudrate=baud, timeout=1 )
-			time.sleep(0.1) # Wait 100 ms after opening the port before sending commands
-			self.ser.flushInput() # Flush the input buffer of the serial port before sending any new commands
-			time.sleep(0.1)
-		else:
-			print('Lockfile could not be acquired for port ' + port)
+		self.port = port
+		self.transport = hvserial.open_transport( port, baud, lock_path=LOCK_PATH ) # shared with other boards on the same port
+		if self.transport is None:
 			print('Is there another program using nhrlib ??')
 			return
+		self.ser = self.transport.ser
 
 
 	def close(self):
 		"""The function closes and releases the serial port connection attached to the unit.
 
 		"""
-		self.ser.close()
-		self.lock.release()
+		self.transport.release()
 
-	def send_command(self, command=''):
+	def send_command(self, command='', timeout=None):
 		"""The function sends a command to the unit and returns the response string.
+		The response is returned as soon as it is complete, or after ``timeout``
+		seconds (default self.timeout) if the unit does not answer.
 
 		"""
-		if command == '': return ''
-		self.ser.write( command.encode('utf-8') )
-		time.sleep(0.1)
-		self.ser.readline() # read out echoed command
-		return self.ser.readline() # return response from the unit
+		if not command: return ''
+		if timeout is None: timeout = self.timeout
+		return self.transport.transaction( command, lines=2, timeout=timeout ) # first line is the echoed command
 
 	def flush_input_buffer(self):
 		""" Flush the input buffer of the serial port.
 		"""
-		self.ser.flushInput()
+		self.transport.flush_input()
 
 	def set_on(self,channel):
 		"""The function turns the voltage ON for the given ``board`` and ``channel`` number.
@@ -65,7 +54,7 @@ class NHR():
 		"""
 
 		if channel not in [0,1,2,3]: return
-		response = self.send_command( ':VOLT ON,(@{ch})\r\n'.format(ch=channel) )
+		response = self.send_command( isegcodec.switch_command('ON', channel) )
 
 	def set_off(self,channel):
 		"""The function turns the voltage OFF for the given ``board`` and ``channel`` number.
@@ -75,7 +64,7 @@ class NHR():
 		"""
 
 		if channel not in [0,1,2,3]: return
-		response = self.send_command( ':VOLT OFF,(@{ch})\r\n'.format(ch=channel) )
+		response = self.send_command( isegcodec.switch_command('OFF', channel) )
 
 	def get_power(self,channel):
 		"""The function returns the power status of the given ``channel`` number.
@@ -84,10 +73,8 @@ class NHR():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( ':READ:VOLT:ON? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-
-		return int(linestr.strip('\n').strip('\r'))
+		response = self.send_command( isegcodec.query_command(':READ:VOLT:ON?', channel) )
+		return isegcodec.parse_int( response )
 
 
 
@@ -97,15 +84,8 @@ class NHR():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( ':MEAS:VOLT? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			voltage = float(pattern.group(0))
-			return voltage
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':MEAS:VOLT?', channel) )
+		return isegcodec.parse_float( response )
 
 	def get_voltage_preset(self,channel):
 		"""The function returns the preset voltage reading of the given ``channel`` number.
@@ -113,15 +93,8 @@ class NHR():
 
 		:param channel: The channel number of which the preset voltage reading is requested.
 		"""
-		response = self.send_command( ':READ:VOLT? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			voltage = float(pattern.group(0))
-			return voltage
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':READ:VOLT?', channel) )
+		return isegcodec.parse_float( response )
 
 	def get_voltage_limit(self,channel):
 		"""The function returns the voltage max limit reading of the given ``channel`` number.
@@ -129,102 +102,124 @@ class NHR():
 
 		:param channel: The channel number of which the preset voltage reading is requested.
 		"""
-		response = self.send_command( ':READ:VOLT:LIM? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			voltage = float(pattern.group(0))
-			return voltage
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':READ:VOLT:LIM?', channel) )
+		return isegcodec.parse_float( response, None ) # None if it can not be read
 
 	def get_current(self,channel):
-		response = self.send_command( ':MEAS:CURR? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			current = float(pattern.group(0))
-			return current * 1e6 # output is in A, we need uA
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':MEAS:CURR?', channel) )
+		return isegcodec.parse_float( response ) * 1e6 # output is in A, we need uA
 
 	def get_current_limit(self,channel):
 		""" not tested !"""
-		response = self.send_command( ':READ:CURR? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			current = float(pattern.group(0))
-			return current * 1e6 # output is in A, we need uA
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':READ:CURR?', channel) )
+		limit = isegcodec.parse_float( response, None ) # None if it can not be read
+		return None if limit is None else limit * 1e6 # output is in A, we need uA
 
 	def get_ramp_up(self,channel):
 		"""Get voltage ramp up speed setting of the unit in V/s
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( ':CONF:RAMP:UP? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			voltage = float(pattern.group(0))
-			return voltage
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':CONF:RAMP:UP?', channel) )
+		return isegcodec.parse_float( response, None ) # None if it can not be read
 
 	def get_ramp_down(self,channel):
 		"""Get voltage ramp down speed setting of the unit in V/s
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( ':CONF:RAMP:DOWN? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			voltage = float(pattern.group(0))
-			return voltage
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':CONF:RAMP:DOWN?', channel) )
+		return isegcodec.parse_float( response, None ) # None if it can not be read
 
 	def get_trip_time(self,channel):
 		"""Get the trip time of the channel in ms
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( ':CONF:TRIP:TIME? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-		pattern = re.match(r'[+\-]?[^A-Za-z]?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+\-]?\d+)', linestr, re.IGNORECASE)
-
-		if pattern is not None:
-			time = float(pattern.group(0))
-			return time
-		else:
-			return 0.
+		response = self.send_command( isegcodec.query_command(':CONF:TRIP:TIME?', channel) )
+		return isegcodec.parse_float( response, None ) # None if it can not be read
 
 	def get_polarity(self,channel):
 		"""Get the polarity of the channel
 		
 		:param channel: The channel number in the module/board
 		"""
-		response = self.send_command( ':CONF:OUTP:POL? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
+		response = self.send_command( isegcodec.query_command(':CONF:OUTP:POL?', channel) )
+		return isegcodec.parse_polarity( response )
+
+	def _query_all(self, query):
+		response = self.send_command( isegcodec.query_command(query, isegcodec.CHANNELS) )
+		return isegcodec.split_answers(response)[0]
+
+	def get_voltage_all(self):
+		"""The function returns the list of the measured voltages of all channels, read with one command."""
+		return isegcodec.parse_all( self._query_all(':MEAS:VOLT?'), isegcodec.parse_float, 0. )
+
+	def get_voltage_preset_all(self):
+		"""The function returns the list of the preset voltages of all channels, read with one command."""
+		return isegcodec.parse_all( self._query_all(':READ:VOLT?'), isegcodec.parse_float, 0. )
+
+	def get_current_all(self):
+		"""The function returns the list of the measured currents of all channels in uA, read with one command."""
+		return [ i * 1e6 for i in isegcodec.parse_all( self._query_all(':MEAS:CURR?'), isegcodec.parse_float, 0. ) ] # output is in A, we need uA
+
+	def get_power_all(self):
+		"""The function returns the list of the power status (0 OFF, 1 ON, -1 unknown) of all channels, read with one command."""
+		return isegcodec.parse_all( self._query_all(':READ:VOLT:ON?'), isegcodec.parse_int, -1 )
+
+	def get_polarity_all(self):
+		"""The function returns the list of the polarities (0 n, 1 p, -1 unknown) of all channels, read with one command."""
+		return isegcodec.parse_all( self._query_all(':CONF:OUTP:POL?'), isegcodec.parse_polarity, -1 )
+
+	def get_voltage_limit_all(self):
+		"""The function returns the list of the voltage limits of all channels, read with one command,
+		None if they can not be read."""
+		return isegcodec.parse_all( self._query_all(':READ:VOLT:LIM?'), isegcodec.parse_float, None )
+
+	def get_current_limit_all(self):
+		"""The function returns the list of the current limits of all channels in uA, read with one command,
+		None if they can not be read."""
+		limits = isegcodec.parse_all( self._query_all(':READ:CURR?'), isegcodec.parse_float, None )
+		return [ None if i is None else i * 1e6 for i in limits ] # output is in A, we need uA
+
+	def get_status_all(self):
+		"""The function returns the list of the status values of all channels, read with one command.
+		See get_status() for the bits.
+		"""
+		return isegcodec.parse_all( self._query_all(':READ:CHAN:STAT?'), isegcodec.parse_int, -1 )
+
+	def get_monitor_all(self, polarity=True):
+		"""The function reads everything the GUI monitors for all channels with two
+		commands of chained queries and returns a dictionary of lists with one value
+		per channel: 'voltage', 'current' (uA), 'voltage_preset', 'power', 'polarity'
+		and 'status'. The polarity query is chained with the others, so it is always
+		read whatever ``polarity`` is.
+		"""
+		measured = self.send_command( isegcodec.MONITOR_COMMANDS[0] )
+		states = self.send_command( isegcodec.MONITOR_COMMANDS[1] )
+		return isegcodec.parse_monitor( measured, states )
+
+	def get_events_all(self):
+		"""The function returns the list of the event status values of all channels and the
+		event status value of the module, read with one command. The event registers latch
+		changes (trips, end of ramp, limits ...) until clear_events() is called.
+		Values that can not be read are -1.
+		"""
+		return isegcodec.parse_events( self.send_command( isegcodec.EVENT_COMMAND ) )
 
-		if linestr.strip('\n').strip('\r') == 'n':
-			return 0
-		elif linestr.strip('\n').strip('\r') == 'p':
-			return 1
-		else:
-			return -1
+	def clear_events(self, channel=isegcodec.CHANNELS):
+		"""The function clears the event status of the given ``channel``, which can be a
+		SCPI channel list like '0,2', default all channels.
+		"""
+		self.send_command( isegcodec.clear_events_command(channel) )
+
+	def clear_module_events(self):
+		"""The function clears the event status of the module."""
+		self.send_command( isegcodec.clear_events_command() )
 
 	def get_serial_number(self):
 		"""Get the serial number of the board/module"""
-		response = self.send_command( ':SYS:USER:SERIAL?\r\n' )
+		response = self.send_command( isegcodec.query_command(':SYS:USER:SERIAL?') )
 		linestr = response.decode('utf8')
 		return str(linestr)
 
@@ -236,10 +231,18 @@ class NHR():
 
 		:param channel: The channel number of which the voltage reading is requested.
 		"""
-		response = self.send_command( ':READ:CHAN:STAT? (@{ch})\r\n'.format(ch=channel) )
-		linestr = response.decode('utf8')
-
-		status = int(linestr.strip('\n').strip('\r'))
+		response = self.send_command( isegcodec.query_command(':READ:CHAN:STAT?', channel) )
+		status = isegcodec.parse_int( response )
+		if status & 32768:
+			print( "Ch{ch} is at its voltage limit".format(ch=channel) )
+		if status & 16384:
+			print( "Ch{ch} is at its current limit".format(ch=channel) )
+		if status & 8192:
+			print( "Ch{ch} has tripped".format(ch=channel) )
+		if status & 4096:
+			print( "Ch{ch} is in external INHIBIT".format(ch=channel) )
+		if status & 32:
+			print( "Ch{ch} is in EMERGENCY off".format(ch=channel) )
 		if status & 16:
 			print( "Ch{ch} is ramping".format(ch=channel) )
 		if status & 8:
@@ -261,10 +264,8 @@ class NHR():
 
 	def get_module_status(self):
 		"""The function returns the status value of the module."""
-		response = self.send_command( ':READ:MOD:STAT?\r\n' )
-		linestr = response.decode('utf8')
-
-		status = int(linestr.strip('\n').strip('\r'))
+		response = self.send_command( isegcodec.query_command(':READ:MOD:STAT?') )
+		status = isegcodec.parse_int( response )
 		if status & 16:
 			print( "Module is service" )
 		else:
@@ -293,7 +294,7 @@ class NHR():
 		if float(voltage) > VOLTAGE_LIMIT: # safety check limit in the library
 			return
 
-		response = self.send_command( ':VOLT {v},(@{ch})\r\n'.format(v=voltage,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':VOLT', voltage, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
 
@@ -312,7 +313,7 @@ class NHR():
 		else:
 			return -1
 
-		response = self.send_command( ':CONF:OUTP:POL {pn},(@{ch})\r\n'.format(pn=polset,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':CONF:OUTP:POL', polset, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
 	def set_current_limit(self,channel, limit):
@@ -324,7 +325,7 @@ class NHR():
 		:param limit: The current limit value that is to be set for the channel in units of A.
 		"""
 		current = limit * 1e-6
-		response = self.send_command( ':CURR {c},(@{ch})\r\n'.format(c=current,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':CURR', current, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
 
@@ -337,7 +338,7 @@ class NHR():
 
 		if float(n) < 1.0 or float(n) > 250.0: return
 
-		response = self.send_command( ':CONF:RAMP:UP {ramp},(@{ch})\r\n'.format(ramp=n,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':CONF:RAMP:UP', n, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
 
@@ -350,7 +351,7 @@ class NHR():
 
 		if float(n) < 1.0 or float(n) > 50.0: return
 
-		response = self.send_command( ':CONF:RAMP:DOWN {ramp},(@{ch})\r\n'.format(ramp=n,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':CONF:RAMP:DOWN', n, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
 
@@ -363,6 +364,6 @@ class NHR():
 
 		if int(time) < 1 or int(time) > 4095: return
 
-		response = self.send_command( ':CONF:TRIP:TIME {t},(@{ch})\r\n'.format(t=time,ch=channel) )
+		response = self.send_command( isegcodec.set_command(':CONF:TRIP:TIME', time, channel) )
 		return response.decode('utf8').strip('\n').strip('\r')
 
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Central scheduler of the monitoring reads of the HV units.
+
+Every (unit, channel, parameter) has its own polling period, e.g. the
+currents fast, the voltages slower and the polarities and limits rarely.
+One thread keeps the deadlines on the monotonic clock and hands each due
+read to the port executor of its unit, without waiting for it, so a slow
+port does not hold up the others. A read that is still running when it
+is due again is skipped rather than queued twice.
+
+The achieved rate of every read is measured and can be reported, together
+with anything else worth watching, see PollScheduler.reporters.
+"""
+
+
+import time
+import heapq
+import threading
+import itertools
+import functools
+import portexecutor
+
+class PollTask():
+	"""One periodic read: ``unit.poll(channel, parameter)`` every ``period`` seconds."""
+	def __init__(self, unit, channel, parameter, period, deadline):
+		self.unit = unit
+		self.channel = channel	# 4 for all channels at once
+		self.parameter = parameter
+		self.period = period
+		self.deadline = deadline	# time.monotonic() of the next read
+		self.future = None	# the read in progress
+		self.runs = 0
+		self.skipped = 0	# reads dropped because the previous one had not finished
+		self.last = None	# time.monotonic() of the end of the last read
+		self.interval = None	# smoothed time between the ends of the reads
+
+	def rate(self):
+		"""The function returns the achieved rate of the read in Hz, or 0. before two reads."""
+		if not self.interval:
+			return 0.
+		return 1./self.interval
+
+class PollScheduler(threading.Thread):
+	"""Runs the periodic reads of the units, see the module documentation.
+	A unit is any object with ``submit(lane, fn, *args)`` returning a future, like
+	VoltageGUI.Unit, and a ``poll(channel, parameter)`` method doing the read.
+	"""
+	def __init__(self, report_time=None):
+		"""
+		:param report_time: Period in s of printing the achieved rates, None for never.
+		"""
+		threading.Thread.__init__(self, name='PollScheduler', daemon=True)
+		self.report_time = report_time
+		self.reporters = []	# functions called by report() after the rates, e.g. printing queue depths
+		self._tasks = {}	# (unit, channel, parameter) -> PollTask
+		self._heap = []	# (deadline, count, key), entries of changed deadlines are skipped
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
+		self._stopped = False
+
+	def add(self, unit, channel, parameter, period, delay=None):
+		"""The function schedules the read of ``parameter`` of ``channel`` (4 for all
+		channels) of ``unit`` every ``period`` seconds, replacing an existing schedule.
+
+		:param delay: Time in s until the first read, default one period.
+		"""
+		key = (unit, channel, parameter)
+		with self._condition:
+			task = PollTask(unit, channel, parameter, period, time.monotonic() + (period if delay is None else delay))
+			self._tasks[key] = task
+			self._push(key, task)
+
+	def set_period(self, unit, channel, parameter, period):
+		"""The function changes the period of a scheduled read. A shorter period takes
+		effect straight away, counted from the last read.
+		"""
+		key = (unit, channel, parameter)
+		with self._condition:
+			task = self._tasks.get(key)
+			if task is None or task.period == period:
+				return
+			task.period = period
+			deadline = (task.last or time.monotonic()) + period
+			if deadline < task.deadline:
+				task.deadline = deadline
+				self._push(key, task)
+
+	def remove(self, unit, channel=None, parameter=None):
+		"""The function stops the matching reads of ``unit``, all of them by default."""
+		with self._condition:
+			for key in list(self._tasks):
+				if key[0] is unit and channel in (None, key[1]) and parameter in (None, key[2]):
+					del self._tasks[key]
+
+	def stop(self):
+		"""The function stops the thread. Reads already handed to the executors still run."""
+		with self._condition:
+			self._stopped = True
+			self._condition.notify()
+
+	def rates(self):
+		"""The function returns a dictionary of the (target, achieved) rates in Hz
+		of the reads by (unit, channel, parameter).
+		"""
+		with self._condition:
+			return { key : (1./task.period, task.rate()) for key, task in self._tasks.items() }
+
+	def report(self):
+		"""The function prints the target and achieved rates of all reads."""
+		with self._condition:
+			tasks = sorted( self._tasks.values(), key=lambda task: (str(getattr(task.unit, 'name', task.unit)), task.channel, task.parameter) )
+			for task in tasks:
+				print( "{unit} ch{ch} {par}: {target:.2f} Hz target, {rate:.2f} Hz achieved, {runs} reads, {skipped} skipped".format(
+						unit=getattr(task.unit, 'name', task.unit), ch=task.channel, par=task.parameter,
+						target=1./task.period, rate=task.rate(), runs=task.runs, skipped=task.skipped) )
+		for reporter in list(self.reporters):
+			reporter()
+
+	def _push(self, key, task):
+		heapq.heappush( self._heap, (task.deadline, next(self._counter), key) )
+		self._condition.notify()
+
+	def run(self):
+		"""Overrides Thread.run. Don't call this directly its called internally
+		when you call Thread.start().
+		"""
+		next_report = None if self.report_time is None else time.monotonic() + self.report_time
+		with self._condition:
+			while not self._stopped:
+				now = time.monotonic()
+				if next_report is not None and now >= next_report:
+					next_report = now + self.report_time
+					self._condition.release()
+					try:
+						self.report()
+					finally:
+						self._condition.acquire()
+				timeout = None if next_report is None else next_report - now
+				if not self._heap:
+					self._condition.wait(timeout)
+					continue
+				deadline, count, key = self._heap[0]
+				if deadline > now:
+					self._condition.wait(deadline - now if timeout is None else min(timeout, deadline - now))
+					continue
+				heapq.heappop(self._heap)
+				task = self._tasks.get(key)
+				if task is None or task.deadline != deadline: # removed or rescheduled
+					continue
+				task.deadline = max(deadline + task.period, now) # keeps the phase, no burst of reads after a stall
+				self._push(key, task)
+				if task.future is not None and not task.future.done():
+					task.skipped += 1
+					continue
+				task.future = task.unit.submit(portexecutor.MONITOR, task.unit.poll, task.channel, task.parameter)
+				task.future.add_done_callback( functools.partial(self._done, task) )
+
+	def _done(self, task, future):
+		now = time.monotonic()
+		if future.cancelled():
+			return
+		error = future.exception()
+		if error is not None:
+			print( "Reading {par} of {unit} failed: {e!r}".format(par=task.parameter, unit=getattr(task.unit, 'name', task.unit), e=error) )
+			return
+		with self._condition:
+			task.runs += 1
+			if task.last is not None:
+				interval = now - task.last
+				task.interval = interval if task.interval is None else 0.8*task.interval + 0.2*interval
+			task.last = now
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Executor that owns the serial port of a HV unit.
+
+Every command for a port is run by one thread, taken from a priority queue
+with three lanes. An emergency off goes before any setpoint, and setpoints,
+enable and polarity changes go before the monitoring reads, so a user
+action waits at most for the command already on the wire.
+
+Boards sharing a port (CAEN lbus) share its executor. Within a lane the
+commands of the different boards are taken in turn.
+"""
+
+
+import threading
+import queue
+import itertools
+from concurrent.futures import Future, TimeoutError
+
+# Lanes, from highest to lowest priority
+EMERGENCY = 0	# emergency off
+CONTROL = 1	# setpoints, enable/disable, polarity
+MONITOR = 2	# monitoring reads
+CALL_TIMEOUT = 60	# time in s a DriverProxy call waits for the port, the commands queued before it included
+
+_executors = {}	# running executors by port name
+_executors_lock = threading.Lock()
+
+def get_executor(port):
+	"""The function returns the executor of ``port``, starting it if no other unit
+	uses the port yet. Every call must be matched by a release().
+	"""
+	with _executors_lock:
+		executor = _executors.get(port)
+		if executor is None:
+			executor = PortExecutor(port)
+			_executors[port] = executor
+		executor.users += 1
+		return executor
+
+class PortExecutor(threading.Thread):
+	def __init__(self,port):
+		threading.Thread.__init__(self, name='PortExecutor-'+str(port), daemon=True)
+		self.port = port
+		self.users = 0
+		self._queue = queue.PriorityQueue()
+		self._counter = itertools.count() # keeps the order of submission within a turn
+		self._lock = threading.Lock()
+		self._turns = {}	# (lane, board) -> turn of the last command queued for the board
+		self._served = [0, 0, 0, 0]	# turn of the last command run, per lane
+		self._stopped = False	# no commands are taken after stop()
+		self.start()
+
+	def submit(self, lane, fn, *args, **kwargs):
+		"""The function queues ``fn(*args, **kwargs)`` on the given ``lane`` and returns
+		a concurrent.futures.Future with its result.
+		When called from a command that is already running on this port, ``fn`` is run
+		straight away, as it would otherwise wait for itself.
+
+		:param lane: EMERGENCY, CONTROL or MONITOR.
+		:param fn: The function to run while owning the port.
+		"""
+		return self.submit_for(None, lane, fn, *args, **kwargs)
+
+	def submit_for(self, board, lane, fn, *args, **kwargs):
+		"""As submit(), for a command addressed to ``board``. The boards on the port get
+		one command each in turn, so a board with many queued commands does not hold up
+		the others. After stop() the future fails with an IOError instead.
+		"""
+		future = Future()
+		if threading.current_thread() is self:
+			self._execute(future, fn, args, kwargs)
+			return future
+		with self._lock:
+			if self._stopped: # nobody would run it
+				future.set_exception( IOError("The port {port} is closed".format(port=self.port)) )
+				return future
+			turn = max(self._turns.get((lane, board), 0), self._served[lane]) + 1
+			self._turns[(lane, board)] = turn
+			self._queue.put( (lane, turn, next(self._counter), future, fn, args, kwargs) )
+		return future
+
+	def release(self):
+		"""The function drops one user of the port, stopping the thread after the last one."""
+		with _executors_lock:
+			self.users -= 1
+			if self.users > 0:
+				return
+			if _executors.get(self.port) is self:
+				del _executors[self.port]
+		self.stop()
+
+	def stop(self):
+		"""The function stops the thread once the commands already queued have been run.
+		Commands submitted afterwards fail.
+		"""
+		with self._lock:
+			self._stopped = True
+			self._queue.put( (MONITOR+1, 0, next(self._counter), None, None, (), {}) )
+
+	def run(self):
+		"""Overrides Thread.run. Don't call this directly its called internally
+		when you call Thread.start().
+		"""
+		while 1:
+			lane, turn, count, future, fn, args, kwargs = self._queue.get()
+			if fn is None:
+				break
+			with self._lock:
+				self._served[lane] = turn
+			if future.set_running_or_notify_cancel():
+				self._execute(future, fn, args, kwargs)
+
+	def _execute(self, future, fn, args, kwargs):
+		try:
+			result = fn(*args, **kwargs)
+		except BaseException as e:
+			future.set_exception(e)
+		else:
+			future.set_result(result)
+
+
+class DriverProxy():
+	"""Wraps a HV unit driver so that each of its methods is run by the port executor.
+	The get_* methods go on the MONITOR lane, everything else on the CONTROL lane.
+	A call waits for its result like a direct call to the driver would, for at most
+	CALL_TIMEOUT, and raises concurrent.futures.TimeoutError if the port is stuck.
+	"""
+	def __init__(self,driver,executor):
+		self.driver = driver
+		self.executor = executor
+		self.board = getattr(driver, 'board', None)
+
+	def __getattr__(self,name):
+		attr = getattr(self.driver, name)
+		if not callable(attr):
+			return attr
+		lane = MONITOR if name.startswith('get_') else CONTROL
+		def call(*args, **kwargs):
+			future = self.executor.submit_for(self.board, lane, attr, *args, **kwargs)
+			try:
+				return future.result(timeout=CALL_TIMEOUT)
+			except TimeoutError:
+				future.cancel() # not sent later if it is still queued
+				raise
+		return call
@@ -1,3 +1,6 @@
+import collections
+import threading
+
 class Element:
 	def __init__(self, number):
 		self.channel = number
@@ -57,3 +60,49 @@ class DoubleQueue:
 
 
 
+
+
+class CommandQueue:
+	"""Thread-safe queue of pending commands keyed by (unit, channel, operation).
+	Putting a command whose key is already pending replaces its value in place, so
+	a newer setpoint for a channel overrides the one not yet sent. Put and get
+	are O(1), the commands are taken in the order their keys were first queued.
+	"""
+	def __init__(self, wakeup=None):
+		"""
+		@param wakeup: threading.Event set whenever a command is put, e.g. to wake the worker
+		"""
+		self._pending=collections.OrderedDict()
+		self._lock=threading.Lock()
+		self.wakeup=wakeup
+
+	def put(self,key,value):
+		"""Queue ``value`` for ``key``, replacing a pending value of the same key."""
+		with self._lock:
+			self._pending[key]=value
+		if self.wakeup is not None:
+			self.wakeup.set()
+
+	def get(self):
+		"""Take the oldest pending command, returns (key, value) or None if there is none."""
+		with self._lock:
+			if not self._pending:
+				return None
+			return self._pending.popitem(last=False)
+
+	def discard(self,key):
+		"""Drop the pending command of ``key``, if any."""
+		with self._lock:
+			self._pending.pop(key,None)
+
+	def depth(self):
+		"""Returns the number of pending commands, e.g. for monitoring."""
+		with self._lock:
+			return len(self._pending)
+
+	def __len__(self):
+		return self.depth()
+
+	def isEmpty(self):
+		with self._lock:
+			return not self._pending
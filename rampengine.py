@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Voltage ramps of the channels, stepped in software for units without a
+usable ramp of their own (MHV-4).
+
+Each ramp is a straight line from the start voltage to the target at a
+given rate in V/s, sent as setpoints of one step each. The k-th setpoint
+is due at a fixed time after the start of the ramp, so the rate does not
+depend on the serial latency or on how many channels ramp at the same
+time. One thread keeps the deadlines of all ramps and hands the
+setpoints to the port executors without waiting for them.
+
+A new target for a ramping channel continues from the last setpoint sent,
+so the voltage does not jump, and at the deadline of the next setpoint, so
+new targets do not make it ramp faster.
+
+A unit that ramps on its own (the CAEN and NHR units, the MHV-4 at 5 to
+500 V/s) can instead get the target as one setpoint. The ramp is then only supervised: it is held
+at the present voltage if the current rises too much before the target
+is reached.
+"""
+
+
+import time
+import math
+import threading
+import portexecutor
+
+SUPERVISE_TIME = 0.5	# period in s of checking the readings of the hardware ramps
+
+class Ramp():
+	"""The trajectory of one channel: setpoint k (1, 2, ...) is start + k*step towards
+	the target, due at t0 + (k-1)*step/rate, the last one being the target itself.
+	"""
+	def __init__(self, unit, channel, start, target, rate, step, hardware=False):
+		self.unit = unit
+		self.channel = channel
+		self.start = start
+		self.target = target
+		self.rate = rate
+		self.step = (abs(target - start) or 1.) if hardware else step # one setpoint when the unit ramps itself
+		self.hardware = hardware
+		self.t0 = time.monotonic()
+		self.k = 0	# setpoints sent so far
+		self.last = None	# last setpoint sent
+		self.future = None	# the setpoint on its way to the unit
+
+	def steps(self):
+		"""The function returns the number of setpoints of the ramp."""
+		return max(1, math.ceil( abs(self.target - self.start) / self.step ))
+
+	def deadline(self):
+		"""The function returns the time.monotonic() when the next setpoint is due."""
+		return self.t0 + self.k * self.step / self.rate
+
+	def position(self):
+		"""The function returns the last setpoint sent, or the start before the first one."""
+		return self.start if self.last is None else self.last
+
+	def value(self, k):
+		"""The function returns setpoint ``k``."""
+		if k >= self.steps():
+			return self.target
+		return self.start + math.copysign(k * self.step, self.target - self.start)
+
+class Supervision():
+	"""The readings of a channel ramping on its own towards ``target``."""
+	def __init__(self, ramp, baseline, until):
+		self.ramp = ramp
+		self.baseline = baseline	# current at the start of the ramp
+		self.until = until	# time.monotonic() after which the ramp is given up
+
+class RampEngine(threading.Thread):
+	"""Runs the ramps of all channels, see the module documentation.
+	A unit is a VoltageGUI.Unit: the setpoints are sent with ``unit.submit()`` and
+	``unit.hvunit.driver.set_voltage()``, and a ramp is stopped when the channel in
+	``unit.channels`` is no longer enabled after its first setpoint.
+	"""
+	def __init__(self, rate, step, current_excursion=None, tolerance=1.):
+		"""
+		:param rate: Default ramp rate in V/s.
+		:param step: Default largest change of the setpoint in V.
+		:param current_excursion: Rise of the current over its value at the start of a
+			hardware ramp that stops the ramp, in the units of the readings. None for no limit.
+		:param tolerance: Difference in V between the voltage and the target of a hardware
+			ramp at which it is finished.
+		"""
+		threading.Thread.__init__(self, name='RampEngine', daemon=True)
+		self.rate = rate
+		self.step = step
+		self.current_excursion = current_excursion
+		self.tolerance = tolerance
+		self._ramps = {}	# (unit, channel) -> Ramp
+		self._supervised = {}	# (unit, channel) -> Supervision of the hardware ramps
+		self._condition = threading.Condition()
+
+	def ramp(self, unit, channel, target, start=None, rate=None, step=None, hardware=False, delay=0.):
+		"""The function ramps ``channel`` of ``unit`` to ``target`` V. A ramp in progress
+		is continued from its last setpoint towards the new target.
+
+		:param start: The voltage to start from, read from the unit by default.
+		:param rate: The ramp rate in V/s, default self.rate. For a hardware ramp the
+			rate the unit is set to, which is only used to give up a ramp that takes too long.
+		:param step: The largest change of the setpoint in V, default self.step.
+		:param hardware: True to send the target as one setpoint to a unit that is set
+			up to ramp on its own, and only supervise the ramp.
+		:param delay: Time in s until the first setpoint, see rampplanner.
+		"""
+		key = (unit, channel)
+		with self._condition:
+			previous = self._ramps.get(key)
+			self._supervised.pop(key, None)
+			position = None if previous is None else previous.position()
+		if position is None and start is None and hardware:
+			start = unit.channels[channel].voltage
+		elif position is None and start is None: # read outside of the lock
+			start = unit.submit(portexecutor.CONTROL, unit.getVoltage, channel).result() # part of the user action, not behind the monitoring reads
+		with self._condition:
+			previous = self._ramps.get(key) # it may have sent a setpoint in the meantime
+			if previous is not None:
+				position = previous.position()
+			ramp = Ramp(unit, channel, start if position is None else position, target, rate or self.rate, step or self.step, hardware)
+			ramp.t0 += delay
+			if previous is not None: # the next setpoint keeps its deadline, a new target does not speed up the ramp
+				ramp.t0 = max(ramp.t0, previous.deadline())
+				ramp.future = previous.future
+			self._ramps[key] = ramp
+			self._condition.notify()
+		unit.markActive(channel)
+
+	def cancel(self, unit, channel=None):
+		"""The function stops the ramps of ``unit``, of all its channels by default.
+		The setpoint already sent stays.
+		"""
+		with self._condition:
+			for ramps in (self._ramps, self._supervised):
+				for key in list(ramps):
+					if key[0] is unit and channel in (None, key[1]):
+						del ramps[key]
+
+	def ramping(self, unit, channel):
+		"""The function returns the target of the ramp of the channel, or None if it is not ramping."""
+		with self._condition:
+			ramp = self._ramps.get( (unit, channel) )
+			if ramp is None and (unit, channel) in self._supervised:
+				ramp = self._supervised[(unit, channel)].ramp
+			return None if ramp is None else ramp.target
+
+	def run(self):
+		"""Overrides Thread.run. Don't call this directly its called internally
+		when you call Thread.start().
+		"""
+		with self._condition:
+			while 1:
+				now = time.monotonic()
+				due = [ ramp for ramp in self._ramps.values() if ramp.deadline() <= now ]
+				for ramp in due:
+					self._send(ramp, now)
+				for supervision in list(self._supervised.values()):
+					self._supervise(supervision, now)
+				# the ramps with a setpoint still on its way wake the thread when it is sent, see _wake()
+				waiting = [ ramp.deadline() for ramp in self._ramps.values() if ramp.future is None or ramp.future.done() ]
+				if self._supervised:
+					waiting.append( now + SUPERVISE_TIME )
+				self._condition.wait( max(0., min(waiting) - time.monotonic()) if waiting else None )
+
+	def _wake(self, future):
+		with self._condition:
+			self._condition.notify()
+
+	def _send(self, ramp, now):
+		key = (ramp.unit, ramp.channel)
+		if ramp.future is not None and not ramp.future.done(): # the port is busy, send it when it is free
+			return
+		if ramp.k > 0 and ramp.unit.channels[ramp.channel].enabled != 1: # e.g. turned off as its voltage went to zero
+			print( "Channel {ch} of unit {name} is OFF, ramp to {v} V stopped".format(ch=ramp.channel, name=ramp.unit.name, v=ramp.target) )
+			del self._ramps[key]
+			return
+		late = now - ramp.deadline()
+		if late > 0: # keep the rate after a delay instead of catching up
+			ramp.t0 += late
+		ramp.k += 1
+		ramp.last = ramp.value(ramp.k)
+		ramp.future = ramp.unit.submit(portexecutor.CONTROL, ramp.unit.hvunit.driver.set_voltage, ramp.channel, ramp.last)
+		ramp.future.add_done_callback(self._wake)
+		if ramp.k >= ramp.steps():
+			del self._ramps[key]
+			ramp.unit.markActive(ramp.channel)
+			if ramp.hardware:
+				until = now + 2*abs(ramp.target - ramp.start)/ramp.rate + 10 # twice the time it should take
+				self._supervised[key] = Supervision(ramp, ramp.unit.channels[ramp.channel].current, until)
+
+	def _supervise(self, supervision, now):
+		ramp = supervision.ramp
+		key = (ramp.unit, ramp.channel)
+		channel = ramp.unit.channels[ramp.channel]
+		if abs(channel.voltage - ramp.target) <= self.tolerance:
+			del self._supervised[key]
+		elif channel.enabled != 1:
+			print( "Channel {ch} of unit {name} is OFF, ramp to {v} V stopped".format(ch=ramp.channel, name=ramp.unit.name, v=ramp.target) )
+			del self._supervised[key]
+		elif self.current_excursion is not None and abs(channel.current) - abs(supervision.baseline) > self.current_excursion:
+			print( "Current of channel {ch} of unit {name} rose to {i}, ramp to {v} V stopped at {u} V".format(
+					ch=ramp.channel, name=ramp.unit.name, i=channel.current, v=ramp.target, u=channel.voltage) )
+			del self._supervised[key]
+			ramp.unit.submit(portexecutor.CONTROL, ramp.unit.hvunit.driver.set_voltage, ramp.channel, channel.voltage) # hold here
+		elif now > supervision.until:
+			print( "Channel {ch} of unit {name} did not reach {v} V, it is at {u} V".format(ch=ramp.channel, name=ramp.unit.name, v=ramp.target, u=channel.voltage) )
+			del self._supervised[key]
+		else:
+			ramp.unit.markActive(ramp.channel) # keep polling fast while it ramps
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Planner of the ramps of a group of channels, e.g. all channels of all units.
+
+Every channel ramps from its start to its target voltage at a rate within
+the limits of its unit: the CAEN and NHR units take whole V/s from 1 to 50,
+the RampEngine ramps the MHV-4 at any rate up to its limit. The planner
+takes one duration for the whole group, the time the slowest channel needs
+at its largest rate or a longer time budget, and gives every channel the
+rate closest to it. A channel that is still faster, e.g. as it can not ramp
+slower than 1 V/s, starts later, so that the group reaches its targets
+together.
+
+All channels are planned at once with NumPy arrays.
+"""
+
+
+import numpy as np
+
+class GroupPlan():
+	"""The ramps of a group of channels, one entry of each array per channel."""
+	def __init__(self, start, target, rate, delay, duration):
+		self.start = start
+		self.target = target
+		self.rate = rate	# V/s
+		self.delay = delay	# s from the start of the group to the start of the ramp of the channel
+		self.duration = duration	# s from the start of the group until all channels are at their targets
+
+	def __len__(self):
+		return len(self.start)
+
+	def finish(self):
+		"""The function returns the array of the times in s at which the channels reach their targets."""
+		return self.delay + np.abs(self.target - self.start) / self.rate
+
+def plan(start, target, max_rate, min_rate=0., resolution=0., budget=None):
+	"""The function returns the GroupPlan ramping the channels from ``start`` to ``target`` V
+	so that they finish together. All arguments but ``budget`` are numbers or arrays with one
+	entry per channel.
+
+	:param max_rate: The largest ramp rate in V/s of each channel.
+	:param min_rate: The smallest ramp rate in V/s of each channel.
+	:param resolution: The step in V/s of the rates a channel can be set to, 0. for any rate.
+	:param budget: The time in s the group should take, default as fast as the slowest channel allows.
+		A budget that is too short for the slowest channel is extended.
+	"""
+	start = np.asarray(start, dtype=float)
+	target = np.asarray(target, dtype=float)
+	max_rate = np.broadcast_to( np.asarray(max_rate, dtype=float), start.shape )
+	min_rate = np.broadcast_to( np.asarray(min_rate, dtype=float), start.shape )
+	resolution = np.broadcast_to( np.asarray(resolution, dtype=float), start.shape )
+	span = np.abs(target - start)
+
+	duration = np.max(span / max_rate, initial=0.)
+	if budget is not None:
+		if budget < duration:
+			print( "The ramp of the group takes {t:.0f} s, longer than the budget of {b:.0f} s".format(t=duration, b=budget) )
+		else:
+			duration = budget
+
+	rate = max_rate.copy()	# channels already at their targets keep it, which is harmless
+	moving = span > 0
+	if duration > 0:
+		rate[moving] = span[moving] / duration
+	quantised = resolution > 0
+	rate[quantised] = np.ceil( rate[quantised] / resolution[quantised] - 1e-9 ) * resolution[quantised] # up, finishing early rather than late
+	rate = np.clip(rate, min_rate, max_rate)
+
+	duration = max( duration, np.max(span / rate, initial=0.) ) # a largest rate off the resolution
+	delay = np.where(moving, duration - span / rate, 0.)
+	return GroupPlan(start, target, rate, delay, duration)
+
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Sender of the readings to the InfluxDB telemetry database.
+
+The readings are taken on the port executors, which must not wait for the
+database. They are queued without waiting and sent by one thread, all the
+points waiting at a time in one request of the line protocol. A database
+that does not answer costs points, not serial time: the points of a
+request that fails are dropped, and so are new points while the queue is full.
+"""
+
+
+import threading
+import queue
+import requests
+
+class TelemetrySender(threading.Thread):
+	"""Sends the points queued with send() to the write ``url`` of the database."""
+	def __init__(self, url, auth=None, timeout=5., maxsize=10000):
+		"""
+		:param auth: The (user, password) of the database.
+		:param timeout: Time in s allowed for a request.
+		:param maxsize: Number of points kept while the database is slow or away.
+		"""
+		threading.Thread.__init__(self, name='TelemetrySender', daemon=True)
+		self.url = url
+		self.auth = auth
+		self.timeout = timeout
+		self._queue = queue.Queue(maxsize)
+		self._failing = False	# the last request failed, printed once until one succeeds
+
+	def send(self, name, channel, meastype, value):
+		"""The function queues one point without waiting, or drops it if the queue is full."""
+		point = 'hv,name=' + str(name) + ',channel=' + str(channel) + ',type=' + str(meastype) + ' value=' + str(value)
+		try:
+			self._queue.put_nowait(point)
+		except queue.Full:
+			pass
+
+	def run(self):
+		"""Overrides Thread.run. Don't call this directly its called internally
+		when you call Thread.start().
+		"""
+		while 1:
+			points = [ self._queue.get() ]
+			while 1: # everything that came in during the last request
+				try:
+					points.append( self._queue.get_nowait() )
+				except queue.Empty:
+					break
+			try:
+				r = requests.post( self.url, data='\n'.join(points), auth=self.auth, verify=False, timeout=self.timeout )
+				r.raise_for_status()
+			except requests.RequestException as e:
+				if not self._failing:
+					print("Telemetry could not be sent, {n} points dropped: {e!r}".format(n=len(points), e=e))
+				self._failing = True
+			else:
+				self._failing = False
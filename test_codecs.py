@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the protocol codecs with replies of the units.
+
+python3 -m pytest test_codecs.py
+"""
+
+
+import caencodec
+import isegcodec
+import mhv4codec
+
+def test_caen_commands():
+	assert caencodec.monitor_command('0', 4, 'VMON') == b'$BD:0,CMD:MON,CH:4,PAR:VMON\r'
+	assert caencodec.monitor_command('0', 4, 'VMON') is caencodec.monitor_command('0', 4, 'VMON') # cached
+	assert caencodec.set_command('1', 2, 'VSET', 120.5) == b'$BD:1,CMD:SET,CH:2,PAR:VSET,VAL:120.5\r'
+
+def test_caen_value():
+	assert caencodec.parse_value(b'#BD:00,CMD:OK,VAL:0123.4') == 123.4
+	assert caencodec.parse_value(b'#BD:00,CMD:OK,VAL:00008', int) == 8
+	assert caencodec.parse_value(b'#BD:00,CMD:ERR', error=-1) == -1
+	assert caencodec.parse_value(b'', nomatch=None) is None # no answer
+
+def test_caen_all_channels():
+	assert caencodec.parse_values(b'#BD:00,CMD:OK,VAL:0123.4;0000.0;0050.1;0199.9') == [123.4, 0., 50.1, 199.9]
+	assert caencodec.parse_values(b'#BD:00,CMD:OK,VAL:00008;00001;00000;00003', int) == [8, 1, 0, 3]
+	assert caencodec.parse_values(b'#BD:00,CMD:OK,VAL:+;-;+;-', str) == ['+', '-', '+', '-']
+	assert caencodec.parse_values(b'#BD:00,CMD:ERR', error=-1) == [-1]*4
+	assert caencodec.parse_values(b'#BD:00,CMD:OK,VAL:0123.4;0000.0', nomatch=None) == [None]*4 # cut short
+	assert caencodec.parse_values(b'', nomatch=None) == [None]*4
+
+def test_iseg_commands():
+	assert isegcodec.query_command(':MEAS:VOLT?', isegcodec.CHANNELS) == b':MEAS:VOLT? (@0-3)\r\n'
+	assert isegcodec.query_command(':READ:MOD:STAT?') == b':READ:MOD:STAT?\r\n'
+	assert isegcodec.clear_events_command('0,2') == b':EV CLEAR,(@0,2)\r\n'
+	assert isegcodec.clear_events_command() == b':CONF:EV CLEAR\r\n'
+
+def test_iseg_value():
+	assert isegcodec.parse_float(b'1.23450E2V') == 123.45
+	assert isegcodec.parse_float(b'-5.00000E-6A') == -5e-6
+	assert isegcodec.parse_float(b'', None) is None
+
+def test_iseg_all_channels():
+	values = isegcodec.split_answers(b'1.2E2V,0.0E0V,5.0E1V,2.0E2V')[0]
+	assert isegcodec.parse_all(values, isegcodec.parse_float, 0.) == [120., 0., 50., 200.]
+	values = isegcodec.split_answers(b'1,0,1,1\r\n')[0]
+	assert isegcodec.parse_all(values, isegcodec.parse_int, -1) == [1, 0, 1, 1]
+	values = isegcodec.split_answers(b'n,p,n,n')[0]
+	assert isegcodec.parse_all(values, isegcodec.parse_polarity, -1) == [0, 1, 0, 0]
+	values = isegcodec.split_answers(b'1.2E2V,0.0E0V')[0] # cut short
+	assert isegcodec.parse_all(values, isegcodec.parse_float, None) == [None]*4
+	assert isegcodec.split_answers(b'', 2) == [None, None] # no answer
+
+def test_iseg_chained():
+	values = isegcodec.parse_monitor(b'1E2V,0E0V,5E1V,2E2V;1E-6A,0E0A,2E-6A,3E-6A;1E2V,0E0V,5E1V,2E2V', b'1,0,1,1;n,p,n,n;8,0,24,8')
+	assert values['voltage'] == [100., 0., 50., 200.]
+	assert values['current'] == [1., 0., 2., 3.] # uA
+	assert values['power'] == [1, 0, 1, 1]
+	assert values['polarity'] == [0, 1, 0, 0]
+	assert values['status'] == [8, 0, 24, 8]
+	assert isegcodec.parse_events(b'0,0,16,0;0') == ([0, 0, 16, 0], 0)
+	assert isegcodec.parse_events(b'0,0,16,0') == ([-1]*4, -1) # the module answer is missing
+
+def test_mhv4_all_channels():
+	assert mhv4codec.command('RU', 4) == b'RU 4\r'
+	assert mhv4codec.set_command('SU', 1, 1205) == b'SU 1 1205\r'
+	assert mhv4codec.parse_signed(b'RU 1: -120.5 V') == -120.5
+	assert mhv4codec.parse_signed(b'', None) is None
+	assert mhv4codec.find_signed(b'RU 4: +120.5 V, -0.0 V, +50.1 V, +199.9 V') == [120.5, -0., 50.1, 199.9]
+	assert mhv4codec.find_signed(b'RU 0: +12.0 V') + mhv4codec.find_signed(b'RU 1: -3.5 V') == [12., -3.5]
+	assert mhv4codec.find_polarity(b'RP 4: positive, negative, positive, negative') == [1, 0, 1, 0]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the helpers without serial I/O: the circuit breaker, the command
+queue, the settings cache, the port executor and the group ramp planner.
+
+python3 -m pytest test_helpers.py
+"""
+
+
+import threading
+import numpy as np
+import pytest
+import health
+import queues
+import hvcache
+import portexecutor
+import rampplanner
+
+def test_breaker_opens_and_closes():
+	breaker = health.CircuitBreaker(threshold=3, backoff=2., max_backoff=5.)
+	assert breaker.record(0, 2) is None
+	assert breaker.record(0, 1) is True # third timeout in a row
+	assert breaker.open
+	assert [ breaker.next_period() for i in range(3) ] == [2., 4., 5.]
+	assert breaker.record(0, 1) is None # still open
+	assert breaker.record(1, 0) is False
+	assert not breaker.open and breaker.failures == 0
+
+def test_breaker_answer_resets_the_count():
+	breaker = health.CircuitBreaker(threshold=3)
+	breaker.record(0, 2)
+	breaker.record(1, 0)
+	assert breaker.record(0, 2) is None
+
+def test_queue_coalesces():
+	work = threading.Event()
+	queue = queues.CommandQueue(work)
+	queue.put(('a', 0, 'voltage'), 10)
+	queue.put(('a', 1, 'voltage'), 20)
+	queue.put(('a', 0, 'voltage'), 30) # replaces the pending value, keeps its place
+	assert work.is_set()
+	assert queue.depth() == len(queue) == 2
+	queue.discard(('a', 1, 'voltage'))
+	assert queue.get() == (('a', 0, 'voltage'), 30)
+	assert queue.get() is None
+	assert queue.isEmpty()
+
+class _Driver():
+	def __init__(self, response):
+		self.response = response
+		self.writes = []
+	def set_ramp_up(self, channel, n):
+		self.writes.append( (channel, n) )
+		return self.response
+
+def test_settings_skip_confirmed_writes():
+	settings = hvcache.SettingsCache()
+	driver = _Driver('#BD:00,CMD:OK')
+	assert settings.write(driver, 0, 'ramp_up', 5) is True
+	assert settings.write(driver, 0, 'ramp_up', 5) is False # already set
+	settings.invalidate()
+	assert settings.write(driver, 0, 'ramp_up', 5) is True
+	assert driver.writes == [ (0, 5), (0, 5) ]
+
+def test_settings_forget_failed_writes():
+	settings = hvcache.SettingsCache()
+	assert settings.write(_Driver('#BD:00,CMD:ERR'), 0, 'ramp_up', 5) is False
+	assert settings.get(0, 'ramp_up') is None
+	assert settings.write(_Driver(''), 0, 'ramp_up', 5) is False # no answer
+	assert settings.get(0, 'ramp_up') is None
+
+def test_executor_refuses_after_stop():
+	executor = portexecutor.get_executor('test')
+	assert executor.submit(portexecutor.MONITOR, lambda: 1).result(timeout=1) == 1
+	executor.release()
+	executor.join(1)
+	assert not executor.is_alive()
+	with pytest.raises(IOError):
+		portexecutor.DriverProxy(_Driver('#BD:00,CMD:OK'), executor).set_ramp_up(0, 5)
+
+def test_plan_finishes_together():
+	group = rampplanner.plan([0., 0., 100.], [100., 50., 100.], max_rate=5.)
+	assert group.duration == 20.
+	assert np.allclose(group.finish()[:2], 20.)
+	assert group.delay[2] == 0. # already at its target
+
+def test_plan_whole_rates():
+	group = rampplanner.plan([0., 0.], [100., 30.], max_rate=5., min_rate=1., resolution=1.)
+	assert list(group.rate) == [5., 2.] # 1.5 V/s rounded up
+	assert np.max(group.finish()) == group.duration == 20.
+	assert group.delay[1] == 5.